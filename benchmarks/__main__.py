@@ -0,0 +1,108 @@
+"""
+Runs the debreach benchmarks and optionally writes the results as JSON, or
+compares them with the results of an earlier run::
+
+    $ python -m benchmarks --json before.json
+    $ git checkout other-branch
+    $ python -m benchmarks --json after.json --compare before.json
+
+Benchmarks can be selected by module name, e.g.
+``python -m benchmarks overhead decorators``.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import subprocess
+import sys
+
+from benchmarks import common
+
+
+MODULES = (
+    'overhead',
+    'middleware',
+    'csrf',
+    'insertion',
+    'entropy',
+    'decorators',
+    'exemptions',
+    'cache',
+    'compression',
+    'asgi',
+    'concurrency',
+)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def results_document():
+    import django
+
+    import debreach
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'debreach': debreach.__version__,
+        'results': [
+            {
+                'benchmark': title,
+                'case': label,
+                'variant': column,
+                'seconds': seconds,
+            }
+            for title, label, column, seconds in common.RESULTS
+        ],
+    }
+
+
+def compare(document, path):
+    with open(path) as f:
+        previous = {
+            (r['benchmark'], r['case'], r['variant']): r['seconds']
+            for r in json.load(f)['results']
+        }
+    print('Compared with {0}'.format(path))
+    for result in document['results']:
+        key = (result['benchmark'], result['case'], result['variant'])
+        if key in previous and previous[key]:
+            print('{0:>8.2f}x  {1} / {2} / {3}'.format(
+                result['seconds'] / previous[key], *key))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument(
+        'modules', nargs='*', metavar='module',
+        help='benchmarks to run, from: {0}'.format(', '.join(MODULES)))
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument(
+        '--compare', help='compare with results previously written to a file')
+    args = parser.parse_args(argv)
+    for name in args.modules:
+        if name not in MODULES:
+            parser.error('unknown benchmark module {0!r}'.format(name))
+    for name in args.modules or MODULES:
+        importlib.import_module('benchmarks.' + name).main()
+    document = results_document()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        compare(document, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Measures ASGI request latency through Django's ``ASGIHandler`` with the
+native async ``RandomCommentMiddleware`` against the previous
+``MiddlewareMixin`` based implementation, which pushes ``process_response``
+through ``sync_to_async``, and with the native middleware recording metrics
+through the in-process collector.
+"""
+import asyncio
+import time
+
+from benchmarks.common import html_body, report, setup_django
+
+
+REQUESTS = 2000
+BODY = html_body(16 * 1024)
+
+
+def legacy_middleware():
+    from django.utils.deprecation import MiddlewareMixin
+
+    from debreach.middleware import (
+        RandomCommentMiddleware, _unused_get_response)
+
+    class LegacyRandomCommentMiddleware(MiddlewareMixin):
+
+        def __init__(self, get_response):
+            super().__init__(get_response)
+            # The padding itself is the same as the native middleware's.
+            self.middleware = RandomCommentMiddleware(_unused_get_response)
+
+        def process_response(self, request, response):
+            return self.middleware.process_response(request, response)
+
+    return LegacyRandomCommentMiddleware
+
+
+async def view(request):
+    from django.http import HttpResponse
+    return HttpResponse(BODY)
+
+
+def make_urlpatterns():
+    from django.urls import path
+    return [path('', view)]
+
+
+async def run_requests(handler, count):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': '/',
+        'raw_path': b'/',
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 1234),
+        'server': ('testserver', 80),
+    }
+
+    disconnected = asyncio.Event()
+
+    def receiver():
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Django listens for a disconnect while the view runs; the
+            # client never goes away.
+            await disconnected.wait()
+        return receive
+
+    async def send(message):
+        # A variant that fails would otherwise time Django's error handling.
+        if message['type'] == 'http.response.start' \
+                and message['status'] != 200:
+            raise RuntimeError(
+                'Status {0} instead of 200'.format(message['status']))
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await handler(dict(scope), receiver(), send)
+    return time.perf_counter() - start
+
+
+def measure_stack(middleware, **overrides):
+    from django.core.handlers.asgi import ASGIHandler
+    from django.test import override_settings
+
+    import benchmarks.asgi as module
+
+    module.LegacyRandomCommentMiddleware = legacy_middleware()
+    module.urlpatterns = make_urlpatterns()
+    with override_settings(
+            MIDDLEWARE=middleware, ROOT_URLCONF='benchmarks.asgi',
+            DEBUG=False, **overrides):
+        handler = ASGIHandler()
+        asyncio.run(run_requests(handler, REQUESTS // 10))
+        return asyncio.run(run_requests(handler, REQUESTS)) / REQUESTS
+
+
+def main():
+    setup_django()
+    native = ['debreach.middleware.RandomCommentMiddleware']
+    stacks = (
+        ('none', [], {}),
+        ('mixin', ['benchmarks.asgi.LegacyRandomCommentMiddleware'], {}),
+        ('native', native, {}),
+        # The native middleware recording metrics in process.
+        ('collector', native, {
+            'DEBREACH_COLLECTOR': 'debreach.metrics.InProcessCollector'}),
+    )
+    rows = [('16KB', {
+        label: measure_stack(middleware, **overrides)
+        for label, middleware, overrides in stacks})]
+    report(
+        'ASGI request (us/request)', rows,
+        [label for label, _, _ in stacks])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures cache-hit latency through Django's cache middleware with and
+without ``RandomCommentMiddleware`` in the stack.
+"""
+from benchmarks.common import (
+    format_size, html_body, measure, report, setup_django)
+
+
+SIZES = (1024, 64 * 1024, 1024 * 1024)
+
+BODIES = {}
+
+
+def view(request):
+    from django.http import HttpResponse
+    return HttpResponse(BODIES[request.GET['size']])
+
+
+def make_urlpatterns():
+    from django.urls import path
+    return [path('', view)]
+
+
+STACKS = (
+    ('cache', [
+        'django.middleware.cache.UpdateCacheMiddleware',
+        'django.middleware.cache.FetchFromCacheMiddleware',
+    ]),
+    ('debreach', [
+        'django.middleware.cache.UpdateCacheMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.cache.FetchFromCacheMiddleware',
+    ]),
+)
+
+
+def main():
+    setup_django()
+    from django.core.cache import cache
+    from django.test import Client, override_settings
+
+    import benchmarks.cache as module
+
+    module.urlpatterns = make_urlpatterns()
+    rows = []
+    for size in SIZES:
+        BODIES[str(size)] = html_body(size)
+        results = {}
+        for label, middleware in STACKS:
+            cache.clear()
+            with override_settings(
+                    MIDDLEWARE=middleware, ROOT_URLCONF='benchmarks.cache'):
+                client = Client()
+                client.get('/', {'size': size})
+                results[label] = measure(
+                    lambda: client.get('/', {'size': size}))
+        rows.append((format_size(size), results))
+    report('Cache hit latency (us/request)', rows, [s[0] for s in STACKS])
+
+
+if __name__ == '__main__':
+    main()
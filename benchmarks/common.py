@@ -0,0 +1,69 @@
+"""
+Shared helpers for the debreach benchmarks.
+
+The benchmarks are plain scripts, run from the repository root, either one at
+a time or all together, e.g.::
+
+    $ python -m benchmarks.middleware
+    $ python -m benchmarks --json results.json
+"""
+import os
+import timeit
+
+
+# Every result reported in this process, as ``(title, label, column,
+# seconds)`` tuples.
+RESULTS = []
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.ALLOWED_HOSTS = ['testserver']
+
+
+def html_body(size):
+    """
+    Returns an HTML document of roughly ``size`` bytes.
+    """
+    head = '<!doctype html><html><head><title>Bench</title></head><body>'
+    tail = '</body></html>'
+    para = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing.</p>\n'
+    count = max(0, size - len(head) - len(tail)) // len(para) + 1
+    return head + para * count + tail
+
+
+def measure(func, repeat=5):
+    """
+    Returns the best observed time, in seconds, for a single call of
+    ``func``.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return '{0:g}{1}'.format(size, unit)
+        size /= 1024
+
+
+def report(title, rows, columns):
+    """
+    Prints ``rows`` (a list of ``(label, {column: seconds})`` pairs) as a
+    table of microseconds per call.
+    """
+    for label, values in rows:
+        for column in columns:
+            RESULTS.append((title, label, column, values[column]))
+    print(title)
+    print('{0:>10}'.format('') + ''.join(
+        '{0:>14}'.format(column) for column in columns))
+    for label, values in rows:
+        print('{0:>10}'.format(label) + ''.join(
+            '{0:>14.2f}'.format(values[column] * 1e6) for column in columns))
+    print()
@@ -0,0 +1,40 @@
+"""
+Compares ``GZipMiddleware`` followed by ``RandomCommentMiddleware`` with the
+single-pass ``RandomCommentCompressionMiddleware``.
+"""
+from benchmarks.common import (
+    format_size, html_body, measure, report, setup_django)
+
+
+SIZES = (1024, 16 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def main():
+    setup_django()
+    from django.http import HttpResponse
+    from django.middleware.gzip import GZipMiddleware
+    from django.test import RequestFactory, override_settings
+
+    from debreach.middleware import (
+        RandomCommentCompressionMiddleware, RandomCommentMiddleware)
+
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+    rows = []
+    for size in SIZES:
+        body = html_body(size).encode('utf-8')
+
+        def view(request):
+            return HttpResponse(body)
+
+        two_middleware = GZipMiddleware(RandomCommentMiddleware(view))
+        with override_settings(DEBREACH_COMPRESSION_CODINGS=['gzip']):
+            combined = RandomCommentCompressionMiddleware(view)
+        rows.append((format_size(size), {
+            'two': measure(lambda: two_middleware(request)),
+            'combined': measure(lambda: combined(request)),
+        }))
+    report('gzip + padding (us/response)', rows, ('two', 'combined'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Drives the middleware and decorators from many threads, and from many
+asyncio tasks, at once. Every response is checked to be padded exactly once,
+with a Content-Length matching its body, and no two responses may share
+their random padding. Throughput is reported for 1, 2, 4, ... threads, up to
+the number of CPUs, as the time per response across all threads, and as the
+speed-up over a single thread.
+
+Each variant's speed-up is compared with that of the bare view, which shows
+how far the interpreter itself scales: about 1x with the GIL, and close to
+the thread count on a free-threaded build. Variants that scale noticeably
+worse are flagged, as are the lines of debreach code run on the hot path
+that take a lock or assign a module global.
+"""
+import asyncio
+import dis
+import os
+import re
+import sys
+import threading
+import time
+
+from benchmarks.common import html_body, report, setup_django
+
+
+REQUESTS_PER_WORKER = 1000
+BODY = html_body(4 * 1024).encode('ascii')
+PADDING_RE = re.compile(rb'<!-- [A-Za-z0-9]+ -->')
+
+# A variant is flagged if its speed-up with the most threads is below this
+# fraction of the bare view's.
+SCALING_TOLERANCE = 0.8
+
+
+def thread_counts():
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    if counts[-1] < 2:
+        counts.append(2)
+    return counts
+
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def view(request):
+    from django.http import HttpResponse
+    response = HttpResponse(BODY)
+    response['Content-Length'] = str(len(BODY))
+    return response
+
+
+async def async_view(request):
+    return view(request)
+
+
+def check(response, paddings, padded=True):
+    """
+    Returns a description of what is wrong with the response, or None,
+    adding its padding to ``paddings``.
+    """
+    content = response.content
+    if int(response['Content-Length']) != len(content):
+        return 'Content-Length {0} for a body of {1} bytes'.format(
+            response['Content-Length'], len(content))
+    if not content.startswith(BODY):
+        return 'body changed'
+    padding = content[len(BODY):]
+    if not padded:
+        return 'padded' if padding else None
+    if not PADDING_RE.fullmatch(padding):
+        return 'padded {0} times'.format(len(PADDING_RE.findall(padding)))
+    paddings.append(padding)
+    return None
+
+
+def run_threads(handler, count, padded):
+    """
+    Calls ``handler`` REQUESTS_PER_WORKER times from each of ``count``
+    threads. Returns the wall time, the errors found and the number of
+    repeated paddings.
+    """
+    from django.test import RequestFactory
+
+    barrier = threading.Barrier(count + 1)
+    results = [None] * count
+
+    def worker(index):
+        request = RequestFactory().get('/')
+        paddings = []
+        errors = []
+        barrier.wait()
+        for _ in range(REQUESTS_PER_WORKER):
+            error = check(handler(request), paddings, padded)
+            if error:
+                errors.append(error)
+        results[index] = (paddings, errors)
+
+    threads = [
+        threading.Thread(target=worker, args=(index,))
+        for index in range(count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return (elapsed,) + collate(results)
+
+
+def run_tasks(handler, count):
+    """
+    Awaits ``handler`` REQUESTS_PER_WORKER times from each of ``count``
+    asyncio tasks, yielding to the event loop between requests.
+    """
+    from django.test import RequestFactory
+
+    async def worker():
+        request = RequestFactory().get('/')
+        paddings = []
+        errors = []
+        for _ in range(REQUESTS_PER_WORKER):
+            error = check(await handler(request), paddings)
+            if error:
+                errors.append(error)
+            await asyncio.sleep(0)
+        return paddings, errors
+
+    async def run():
+        return await asyncio.gather(*(worker() for _ in range(count)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return (elapsed,) + collate(results)
+
+
+def collate(results):
+    paddings = [padding for result in results for padding in result[0]]
+    errors = [error for result in results for error in result[1]]
+    return errors, len(paddings) - len(set(paddings))
+
+
+def audit(handler, calls=10):
+    """
+    Runs ``handler`` under a line tracer, and returns the lines of debreach
+    code it ran that take a lock or assign a module global.
+    """
+    from django.test import RequestFactory
+
+    request = RequestFactory().get('/')
+    # Per-thread state is built by the first call in each thread.
+    handler(request)
+    executed = set()
+
+    def trace(frame, event, arg):
+        if not frame.f_globals.get('__name__', '').startswith('debreach'):
+            return None
+        if event == 'line':
+            executed.add((frame.f_code, frame.f_lineno))
+        return trace
+
+    sys.settrace(trace)
+    try:
+        for _ in range(calls):
+            handler(request)
+    finally:
+        sys.settrace(None)
+    findings = set()
+    for code in {code for code, _ in executed}:
+        line = None
+        for instruction in dis.get_instructions(code):
+            # Before Python 3.13 starts_line is the line number of the first
+            # instruction of each line, and None for the others.
+            if hasattr(instruction, 'line_number'):
+                line = instruction.line_number
+            elif instruction.starts_line is not None:
+                line = instruction.starts_line
+            if (code, line) not in executed:
+                continue
+            # co_qualname is new in Python 3.11.
+            location = '{0}:{1} ({2})'.format(
+                os.path.relpath(code.co_filename), line,
+                getattr(code, 'co_qualname', code.co_name))
+            if instruction.opname == 'STORE_GLOBAL':
+                findings.add('{0} assigns the global {1}'.format(
+                    location, instruction.argval))
+            elif 'lock' in str(instruction.argval).lower() \
+                    and instruction.opname.startswith('LOAD_'):
+                findings.add('{0} takes {1}'.format(
+                    location, instruction.argval))
+    return sorted(findings)
+
+
+def variants():
+    """
+    Returns ``(label, settings, make_handler, padded)`` for each variant.
+    Handlers are made inside the variant's settings.
+    """
+    from debreach.decorators import append_random_comment
+    from debreach.middleware import RandomCommentMiddleware
+
+    return (
+        ('view', {}, lambda: view, False),
+        ('middleware', {}, lambda: RandomCommentMiddleware(view), True),
+        ('decorator', {}, lambda: append_random_comment(view), True),
+        ('both', {}, lambda: RandomCommentMiddleware(
+            append_random_comment(view)), True),
+        ('collector', {
+            'DEBREACH_COLLECTOR': 'debreach.metrics.InProcessCollector',
+        }, lambda: RandomCommentMiddleware(view), True),
+        ('budget', {
+            'DEBREACH_PADDING': {
+                'distribution': 'uniform', 'minimum': 12, 'maximum': 24,
+                'budget': 1},
+        }, lambda: RandomCommentMiddleware(view), True),
+    )
+
+
+def main():
+    setup_django()
+    from django.test import override_settings
+
+    from debreach.middleware import RandomCommentMiddleware
+
+    counts = thread_counts()
+    columns = tuple(str(count) for count in counts)
+    rows = []
+    speedups = {}
+    failures = []
+    findings = {}
+    for label, overrides, make_handler, padded in variants():
+        with override_settings(**overrides):
+            handler = make_handler()
+            # Warm up, so that lazily built state isn't counted or audited.
+            run_threads(handler, 1, padded)
+            findings[label] = audit(handler)
+            values = {}
+            for count in counts:
+                elapsed, errors, repeats = run_threads(
+                    handler, count, padded)
+                values[str(count)] = elapsed / (count * REQUESTS_PER_WORKER)
+                if errors or repeats:
+                    failures.append((label, count, errors, repeats))
+        rows.append((label, values))
+        speedups[label] = [
+            values[columns[0]] / values[column] for column in columns]
+    report(
+        'Threads, GIL {0} (us/response across all threads)'.format(
+            'enabled' if gil_enabled() else 'disabled'),
+        rows, columns)
+
+    print('Speed-up over one thread')
+    print('{0:>10}'.format('') + ''.join(
+        '{0:>14}'.format(column) for column in columns))
+    for label, values in speedups.items():
+        print('{0:>10}'.format(label) + ''.join(
+            '{0:>13.2f}x'.format(value) for value in values))
+    print()
+
+    async_middleware = RandomCommentMiddleware(async_view)
+    rows = []
+    for count in counts:
+        elapsed, errors, repeats = run_tasks(async_middleware, count)
+        rows.append((str(count), {
+            'middleware': elapsed / (count * REQUESTS_PER_WORKER)}))
+        if errors or repeats:
+            failures.append(('async', count, errors, repeats))
+    report(
+        'Asyncio tasks (us/response across all tasks)', rows,
+        ('middleware',))
+
+    baseline = speedups['view'][-1]
+    for label, values in speedups.items():
+        if values[-1] < baseline * SCALING_TOLERANCE:
+            print('FLAG {0}: {1:.2f}x with {2} threads, against {3:.2f}x '
+                  'for the bare view'.format(
+                      label, values[-1], columns[-1], baseline))
+    for label, lines in findings.items():
+        for line in lines:
+            print('FLAG {0}: {1}'.format(label, line))
+    for label, count, errors, repeats in failures:
+        print('FAIL {0} with {1} workers: {2} bad responses{3}, {4} repeated '
+              'paddings'.format(
+                  label, count, len(errors),
+                  ' ({0})'.format(errors[0]) if errors else '', repeats))
+    if not failures:
+        print('Every response was padded exactly once, with a correct '
+              'Content-Length and unique padding.')
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compares Django's CSRF token handling with debreach's for a forms-heavy page
+that renders each of its forms from a separate template, as inclusion tags
+and ``render_to_string`` do, and compares unmasking a submitted token.
+"""
+from benchmarks.common import measure, report, setup_django
+
+
+FORMS = (1, 10, 50)
+FORM = (
+    '<form method="post">{% csrf_token %}'
+    '<input type="text" name="q"><button>Go</button></form>')
+
+
+def main():
+    setup_django()
+    from django.middleware.csrf import (
+        _get_new_csrf_string, _mask_cipher_secret, _unmask_cipher_token)
+    from django.template import Engine, RequestContext
+    from django.test import RequestFactory
+
+    from debreach.csrf import unmask_token
+
+    # Django's own csrf processor is always applied by RequestContext, so
+    # only debreach's is added to the engine being measured.
+    engines = (
+        ('django', Engine()),
+        ('debreach', Engine(context_processors=[
+            'debreach.context_processors.csrf'])),
+    )
+    rows = []
+    for forms in FORMS:
+        results = {}
+        for label, engine in engines:
+            template = engine.from_string(FORM)
+
+            def render():
+                request = RequestFactory().get('/')
+                return ''.join(
+                    template.render(RequestContext(request))
+                    for _ in range(forms))
+
+            results[label] = measure(render)
+        rows.append(('{0} forms'.format(forms), results))
+    report(
+        'Rendering forms from separate templates (us/page)', rows,
+        [label for label, _ in engines])
+
+    token = _mask_cipher_secret(_get_new_csrf_string())
+    report('Unmasking a submitted token (us/token)', [('token', {
+        'django': measure(lambda: _unmask_cipher_token(token)),
+        'debreach': measure(lambda: unmask_token(token)),
+    })], ('django', 'debreach'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Measures the per-call overhead of the decorators against the previous
+``decorator_from_middleware`` and wrapper based implementations.
+"""
+from functools import wraps
+
+from benchmarks.common import measure, report, setup_django
+
+
+def legacy_random_comment_exempt(view_func):
+    def wrapped_view(*args, **kwargs):
+        response = view_func(*args, **kwargs)
+        response._random_comment_exempt = True
+        return response
+    return wraps(view_func)(wrapped_view)
+
+
+def main():
+    setup_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django.utils.decorators import decorator_from_middleware
+
+    from debreach.decorators import (
+        append_random_comment, random_comment_exempt)
+    from debreach.middleware import RandomCommentMiddleware
+
+    legacy_append_random_comment = decorator_from_middleware(
+        RandomCommentMiddleware)
+    request = RequestFactory().get('/')
+    rows = []
+    for label, content_type in (('text', 'text/plain'), ('html', 'text/html')):
+        def view(request, content_type=content_type):
+            return HttpResponse(b'<p>Body</p>', content_type=content_type)
+
+        old_append = legacy_append_random_comment(view)
+        new_append = append_random_comment(view)
+        old_exempt = legacy_random_comment_exempt(view)
+        new_exempt = random_comment_exempt(view)
+        rows.append((label, {
+            'view': measure(lambda: view(request)),
+            'old append': measure(lambda: old_append(request)),
+            'new append': measure(lambda: new_append(request)),
+            'old exempt': measure(lambda: old_exempt(request)),
+            'new exempt': measure(lambda: new_exempt(request)),
+        }))
+    report(
+        'Decorated view call (us/call)', rows,
+        ('view', 'old append', 'new append', 'old exempt', 'new exempt'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares the per-response cost of generating padding with
+``get_random_string`` against the buffered ``debreach.entropy`` pool, and
+measures drawing a length from each of the padding length distributions.
+"""
+import random
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    setup_django()
+    from django.utils.crypto import get_random_string
+
+    from debreach.distributions import (
+        GeometricDistribution, ProportionalDistribution, UniformDistribution)
+    from debreach.entropy import EntropyPool
+    from debreach.padding import random_comment
+
+    pool = EntropyPool()
+    rows = [
+        ('padding', {
+            'before': measure(
+                lambda: get_random_string(random.choice(range(12, 25)))),
+            'after': measure(
+                lambda: pool.random_string(12 + pool.randbelow(13))),
+        }),
+        ('length', {
+            'before': measure(lambda: random.choice(range(12, 25))),
+            'after': measure(lambda: pool.randbelow(13)),
+        }),
+        ('comment', {
+            'before': measure(lambda: '<!-- {0} -->'.format(
+                get_random_string(random.choice(range(12, 25))))),
+            'after': measure(random_comment),
+        }),
+    ]
+    report('Padding generation (us/call)', rows, ('before', 'after'))
+
+    distributions = (
+        ('uniform', UniformDistribution(16, 272)),
+        ('geometric', GeometricDistribution(16, 1024, mean=64)),
+        ('proportional', ProportionalDistribution(16, percent=1)),
+        ('capped', UniformDistribution(16, 272, cap=5)),
+        ('budget', UniformDistribution(16, 272, budget=2)),
+    )
+    rows = [
+        (label, {
+            '1KB': measure(lambda: distribution.length(1024)),
+            '64KB': measure(lambda: distribution.length(64 * 1024)),
+        })
+        for label, distribution in distributions]
+    report(
+        'Padding length distributions (us/call)', rows, ('1KB', '64KB'))
+
+
+if __name__ == '__main__':
+    main()
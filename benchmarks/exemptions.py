@@ -0,0 +1,35 @@
+"""
+Measures exemption lookups against thousands of path prefixes, comparing the
+compiled ``PrefixTrie`` with a linear ``str.startswith`` scan.
+"""
+from benchmarks.common import measure, report, setup_django
+
+
+RULES = (10, 100, 1000, 10000)
+
+
+def main():
+    setup_django()
+    from debreach.exemptions import PrefixTrie
+
+    rows = []
+    for count in RULES:
+        prefixes = ['/section-{0}/page/'.format(i) for i in range(count)]
+        trie = PrefixTrie(prefixes)
+        hit = prefixes[-1] + 'detail/'
+        miss = '/unrelated/path/to/a/page/'
+        rows.append((str(count), {
+            'trie hit': measure(lambda: trie.matches(hit)),
+            'trie miss': measure(lambda: trie.matches(miss)),
+            'scan hit': measure(
+                lambda: any(hit.startswith(p) for p in prefixes)),
+            'scan miss': measure(
+                lambda: any(miss.startswith(p) for p in prefixes)),
+        }))
+    report(
+        'Exemption lookup (us/lookup) by number of rules', rows,
+        ('trie hit', 'trie miss', 'scan hit', 'scan miss'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares padding inserted after ``</head>`` and the CSRF token input with the
+default trailing comment, across a range of body sizes. The CSRF input is
+placed at the end of the body, so beyond the scan limit the insertion mode
+falls back to a trailing comment.
+"""
+from benchmarks.common import (
+    format_size, html_body, measure, report, setup_django)
+
+
+SIZES = (1024, 16 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024)
+CSRF_INPUT = (
+    '<form><input type="hidden" name="csrfmiddlewaretoken" '
+    'value="token"></form></body>')
+
+
+def main():
+    setup_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory, override_settings
+
+    from debreach.middleware import RandomCommentMiddleware
+
+    request = RequestFactory().get('/')
+    trailing = RandomCommentMiddleware(lambda request: None)
+    with override_settings(DEBREACH_INSERTION_POINTS=[
+            '</head>', 'name="csrfmiddlewaretoken"']):
+        inserted = RandomCommentMiddleware(lambda request: None)
+    rows = []
+    for size in SIZES:
+        body = html_body(size).replace('</body>', CSRF_INPUT).encode('utf-8')
+
+        def run(middleware):
+            response = HttpResponse(body)
+            response['Content-Length'] = str(len(body))
+            middleware.process_response(request, response)
+            b''.join(response)
+
+        rows.append((format_size(size), {
+            'trailing': measure(lambda: run(trailing)),
+            'inserted': measure(lambda: run(inserted)),
+        }))
+    report(
+        'Trailing and inserted padding (us/response)', rows,
+        ('trailing', 'inserted'))
+
+
+if __name__ == '__main__':
+    main()
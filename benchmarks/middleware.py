@@ -0,0 +1,62 @@
+"""
+Compares ``RandomCommentMiddleware.process_response`` against the previous
+decode/format/re-encode implementation across a range of body sizes.
+"""
+import random
+
+from benchmarks.common import (
+    format_size, html_body, measure, report, setup_django)
+
+
+SIZES = (1024, 16 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024)
+
+
+def legacy_process_response(request, response):
+    from django.utils.crypto import get_random_string
+    from django.utils.encoding import force_str
+    if not getattr(response, 'streaming', False) \
+            and response.get('Content-Type', '').startswith('text/html') \
+            and response.content \
+            and isinstance(response.content, (bytes, str)) \
+            and not getattr(response, '_random_comment_exempt', False) \
+            and not getattr(response, '_random_comment_applied', False):
+        comment = '<!-- {0} -->'.format(
+            get_random_string(random.choice(range(12, 25))))
+        response.content = '{0}{1}'.format(
+            force_str(response.content), comment)
+        response._random_comment_applied = True
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+    return response
+
+
+def main():
+    setup_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+
+    from debreach.middleware import RandomCommentMiddleware
+
+    request = RequestFactory().get('/')
+    middleware = RandomCommentMiddleware(lambda request: None)
+    rows = []
+    for size in SIZES:
+        body = html_body(size).encode('utf-8')
+
+        def run(process):
+            response = HttpResponse(body)
+            response['Content-Length'] = str(len(body))
+            process(request, response)
+            # Include serialisation, which is where the body is finally
+            # joined for the WSGI handler.
+            b''.join(response)
+
+        rows.append((format_size(size), {
+            'before': measure(lambda: run(legacy_process_response)),
+            'after': measure(lambda: run(middleware.process_response)),
+        }))
+    report('process_response (us/response)', rows, ('before', 'after'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Measures the per-response overhead of ``RandomCommentMiddleware`` for a range
+of body sizes and body representations, its fast paths for responses that
+aren't padded, the cost of collecting metrics, and the full test_project
+stack through the test client.
+"""
+from benchmarks.common import (
+    format_size, html_body, measure, report, setup_django)
+
+
+SIZES = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+CHUNKS = 16
+
+
+def body_sizes(middleware, request):
+    from django.http import HttpResponse
+
+    rows = []
+    for size in SIZES:
+        text = html_body(size)
+        body = text.encode('utf-8')
+        step = len(body) // CHUNKS + 1
+        chunks = [body[i:i + step] for i in range(0, len(body), step)]
+
+        def chunked():
+            response = HttpResponse()
+            for chunk in chunks:
+                response.write(chunk)
+            return response
+
+        results = {}
+        for label, make_response in (
+                ('bytes', lambda: HttpResponse(body)),
+                ('str', lambda: HttpResponse(text)),
+                ('chunks', chunked)):
+            # Report only the time added by the middleware, not the time
+            # taken to build the response.
+            results[label] = max(0, measure(
+                lambda: middleware.process_response(
+                    request, make_response())) - measure(make_response))
+        rows.append((format_size(size), results))
+    report(
+        'process_response overhead by body size (us/response)', rows,
+        ('bytes', 'str', 'chunks'))
+
+
+def fast_paths(middleware, request):
+    from django.http import HttpResponse, StreamingHttpResponse
+    from django.test import override_settings
+
+    from debreach.exemptions import get_index
+
+    body = html_body(16 * 1024).encode('utf-8')
+
+    def exempt():
+        response = HttpResponse(body)
+        response._random_comment_exempt = True
+        return response
+
+    def applied():
+        response = HttpResponse(body)
+        response._random_comment_applied = True
+        return response
+
+    cases = (
+        ('padded', lambda: HttpResponse(body)),
+        ('exempt', exempt),
+        ('applied', applied),
+        ('non-html', lambda: HttpResponse(body, content_type='text/plain')),
+        ('empty', lambda: HttpResponse(b'')),
+        ('streaming', lambda: StreamingHttpResponse([body])),
+    )
+    rows = []
+    for label, make_response in cases:
+        rows.append((label, {
+            'baseline': measure(make_response),
+            'middleware': measure(lambda: middleware.process_response(
+                request, make_response())),
+        }))
+    with override_settings(DEBREACH_EXEMPT_PATHS=['/']):
+        get_index()
+        rows.append(('exempt path', {
+            'baseline': measure(lambda: HttpResponse(body)),
+            'middleware': measure(lambda: middleware.process_response(
+                request, HttpResponse(body))),
+        }))
+    report(
+        'process_response fast paths, 16KB (us/response)', rows,
+        ('baseline', 'middleware'))
+
+
+def collectors(request):
+    from django.http import HttpResponse
+    from django.test import override_settings
+
+    from debreach.middleware import RandomCommentMiddleware
+
+    body = html_body(16 * 1024).encode('utf-8')
+    rows = []
+    for label, path in (
+            ('null', None),
+            ('in-process', 'debreach.metrics.InProcessCollector')):
+        with override_settings(DEBREACH_COLLECTOR=path):
+            middleware = RandomCommentMiddleware(lambda request: None)
+            rows.append((label, {
+                'padded': measure(lambda: middleware.process_response(
+                    request, HttpResponse(body))),
+                'skipped': measure(lambda: middleware.process_response(
+                    request, HttpResponse(body, content_type='text/plain'))),
+            }))
+    report(
+        'Metrics collectors, 16KB (us/response)', rows, ('padded', 'skipped'))
+
+
+def stack():
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    stacks = (
+        ('none', []),
+        ('debreach', ['debreach.middleware.RandomCommentMiddleware']),
+    )
+    rows = []
+    for url_name in ('home', 'test_form'):
+        url = reverse(url_name)
+        results = {}
+        for label, middleware in stacks:
+            with override_settings(MIDDLEWARE=[
+                    *middleware,
+                    'django.middleware.csrf.CsrfViewMiddleware']):
+                client = Client()
+                results[label] = measure(lambda: client.get(url))
+        rows.append((url_name, results))
+    report(
+        'test_project through the test client (us/request)', rows,
+        [label for label, _ in stacks])
+
+
+def main():
+    setup_django()
+    from django.test import RequestFactory
+
+    from debreach.middleware import RandomCommentMiddleware
+
+    middleware = RandomCommentMiddleware(lambda request: None)
+    request = RequestFactory().get('/')
+    body_sizes(middleware, request)
+    fast_paths(middleware, request)
+    collectors(request)
+    stack()
+
+
+if __name__ == '__main__':
+    main()
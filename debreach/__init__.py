@@ -1,5 +1,7 @@
 import packaging.version
 
+from debreach.utils import mark_sensitive  # noqa: F401
+
 
 __version__ = '2.1.0'
 version_info = packaging.version.Version(__version__).release
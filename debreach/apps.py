@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+from debreach.checks import (
+    SETTINGS_ACCESSORS, check_middleware, check_settings)
+from debreach.padding import comment_delimiters
 
 
 class DebreachConfig(AppConfig):
 
     name = 'debreach'
+
+    def ready(self):
+        checks.register(check_middleware, checks.Tags.security)
+        checks.register(check_settings)
+        self.warm_up()
+
+    def warm_up(self):
+        """
+        Builds the padding length tables, content type registry, exemption
+        index, collector and entropy pool, so that the first request in each
+        worker costs the same as the rest.
+        """
+        for names, accessor in SETTINGS_ACCESSORS:
+            try:
+                accessor()
+            except Exception:
+                # Reported by check_settings instead; the error is raised
+                # again by the first request to use the setting.
+                pass
+        comment_delimiters(settings.DEFAULT_CHARSET)
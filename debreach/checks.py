@@ -0,0 +1,107 @@
+"""
+System checks for the middleware order and the DEBREACH_* settings.
+"""
+from django.conf import settings
+from django.core.checks import Error, Warning
+from django.utils.module_loading import import_string
+
+from debreach.distributions import get_distribution
+from debreach.entropy import get_pool
+from debreach.exemptions import get_index
+from debreach.metrics import get_collector
+from debreach.padding import get_registry
+
+
+GZIP_MIDDLEWARE = 'django.middleware.gzip.GZipMiddleware'
+CSRF_MIDDLEWARE = 'django.middleware.csrf.CsrfViewMiddleware'
+PADDING_MIDDLEWARE = (
+    'debreach.middleware.RandomCommentMiddleware',
+    'debreach.middleware.RandomCommentCompressionMiddleware',
+)
+COMPRESSION_MIDDLEWARE = \
+    'debreach.middleware.RandomCommentCompressionMiddleware'
+CSRF_CRYPT_MIDDLEWARE = 'debreach.middleware.CSRFCryptMiddleware'
+
+# The accessors that build what the middleware needs from the settings.
+SETTINGS_ACCESSORS = (
+    ('DEBREACH_PADDING', get_distribution),
+    ('DEBREACH_CONTENT_TYPES', get_registry),
+    ('DEBREACH_COLLECTOR', get_collector),
+    ('DEBREACH_EXEMPT_* or DEBREACH_INCLUDE_PATHS', get_index),
+    ('DEBREACH_ENTROPY_*', get_pool),
+)
+
+
+def check_middleware(app_configs, **kwargs):
+    """
+    Checks that the debreach middleware in the MIDDLEWARE setting exists and
+    is ordered so that padding is added before compression and CSRF tokens
+    are unmasked before they are checked.
+    """
+    errors = []
+    middleware = list(getattr(settings, 'MIDDLEWARE', None) or ())
+    stale = [
+        path for path in getattr(settings, 'MIDDLEWARE_CLASSES', None) or ()
+        if path.startswith('debreach.') and path not in middleware]
+    if stale:
+        errors.append(Warning(
+            'The MIDDLEWARE_CLASSES setting is ignored, so {0} is not '
+            'installed.'.format(', '.join(stale)),
+            hint='Move the middleware to the MIDDLEWARE setting.',
+            id='debreach.W001'))
+    for path in middleware:
+        if not path.startswith('debreach.'):
+            continue
+        try:
+            import_string(path)
+        except ImportError:
+            errors.append(Error(
+                '{0} in the MIDDLEWARE setting does not exist.'.format(path),
+                id='debreach.E001'))
+    padding = [path for path in middleware if path in PADDING_MIDDLEWARE]
+    if GZIP_MIDDLEWARE in middleware and padding and \
+            middleware.index(GZIP_MIDDLEWARE) > middleware.index(padding[0]):
+        errors.append(Warning(
+            'GZipMiddleware is listed after {0}, so responses are compressed '
+            'before they are padded.'.format(padding[0]),
+            hint='Move GZipMiddleware before {0}.'.format(padding[0]),
+            id='debreach.W002'))
+    if len(padding) > 1:
+        errors.append(Warning(
+            'More than one padding middleware is listed; responses are only '
+            'padded by the first to process them.',
+            hint='Use only one of {0}.'.format(', '.join(padding)),
+            id='debreach.W003'))
+    if COMPRESSION_MIDDLEWARE in middleware \
+            and GZIP_MIDDLEWARE in middleware:
+        errors.append(Warning(
+            'RandomCommentCompressionMiddleware and GZipMiddleware are both '
+            'listed.',
+            hint='Remove GZipMiddleware; RandomCommentCompressionMiddleware '
+                 'compresses responses itself.',
+            id='debreach.W004'))
+    if CSRF_CRYPT_MIDDLEWARE in middleware and CSRF_MIDDLEWARE in middleware \
+            and middleware.index(CSRF_CRYPT_MIDDLEWARE) \
+            > middleware.index(CSRF_MIDDLEWARE):
+        errors.append(Warning(
+            'CSRFCryptMiddleware is listed after CsrfViewMiddleware, so '
+            'submitted tokens are checked before it unmasks them.',
+            hint='Move CSRFCryptMiddleware before CsrfViewMiddleware.',
+            id='debreach.W005'))
+    return errors
+
+
+def check_settings(app_configs, **kwargs):
+    """
+    Checks that the DEBREACH_* settings are valid by building everything
+    the middleware builds from them.
+    """
+    errors = []
+    for names, accessor in SETTINGS_ACCESSORS:
+        try:
+            accessor()
+        except Exception as e:
+            errors.append(Error(
+                'Invalid {0} setting: {1}'.format(names, e),
+                id='debreach.E002'))
+    return errors
@@ -0,0 +1,132 @@
+"""
+Incremental compressors for the content codings supported by the
+RandomCommentCompressionMiddleware.
+
+``gzip`` is always available. ``br`` requires the ``brotli`` module and
+``zstd`` requires either ``compression.zstd`` (Python 3.14+) or the
+``zstandard`` module; codings whose module isn't installed are never
+selected.
+"""
+import functools
+import zlib
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'br': 4,
+    'zstd': 3,
+}
+
+
+class GZipCompressor:
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+
+    def __init__(self, level):
+        if zstd is not None:
+            self._compressor = zstd.ZstdCompressor(level=level)
+            self._flush_block = zstd.ZstdCompressor.FLUSH_BLOCK
+        else:
+            self._compressor = zstandard.ZstdCompressor(
+                level=level).compressobj()
+            self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(self._flush_block)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+COMPRESSORS = {'gzip': GZipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+if zstd is not None or zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+@functools.lru_cache(maxsize=128)
+def accepted_codings(accept_encoding):
+    """
+    Returns the sets of content codings accepted and explicitly refused
+    (with ``q=0``) by an Accept-Encoding header.
+    """
+    codings = set()
+    refused = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            (codings if quality > 0 else refused).add(coding)
+    return frozenset(codings), frozenset(refused)
+
+
+def select_coding(accept_encoding, preference):
+    """
+    Returns the first coding in ``preference`` that is both available and
+    acceptable to the client, or None.
+    """
+    if not accept_encoding:
+        return None
+    accepted, refused = accepted_codings(accept_encoding)
+    for coding in preference:
+        if coding in COMPRESSORS and (coding in accepted or (
+                '*' in accepted and coding not in refused)):
+            return coding
+    return None
@@ -0,0 +1,63 @@
+"""
+Memoised masking, and vectorised unmasking, of Django's CSRF tokens.
+
+Django masks the CSRF secret afresh on every call to ``get_token``, and
+unmasks submitted tokens a character at a time. Here the token is masked at
+most once per request, and a submitted token is unmasked by translating both
+halves to alphabet indexes and subtracting them as integers, one byte per
+character, so the work doesn't depend on the token's value.
+"""
+from django.middleware.csrf import (
+    CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH, CSRF_TOKEN_LENGTH,
+    get_token as django_get_token)
+
+
+_CHARS = CSRF_ALLOWED_CHARS.encode('ascii')
+
+# Maps each allowed character to its index in the alphabet, and anything
+# else to 0xff.
+_INDEXES = bytes(
+    _CHARS.index(b) if b in _CHARS else 0xff for b in range(256))
+
+# Maps an index plus the alphabet size, less another index, back to the
+# character for their difference modulo the alphabet size.
+_CHARACTERS = bytes(
+    _CHARS[b % len(_CHARS)] if b < 2 * len(_CHARS) else 0
+    for b in range(256))
+
+# The alphabet size in every byte, so subtracting one integer of indexes
+# from another never borrows across bytes.
+_OFFSET = int.from_bytes(bytes([len(_CHARS)]) * CSRF_SECRET_LENGTH, 'big')
+
+
+def get_token(request):
+    """
+    Returns the CSRF token for the request, as
+    ``django.middleware.csrf.get_token`` does, but masks the secret only
+    once per request; later calls return the same token unless the secret
+    is rotated.
+    """
+    secret = request.META.get('CSRF_COOKIE')
+    memo = getattr(request, '_debreach_csrf_token', None)
+    if memo is not None and secret is not None and memo[0] == secret:
+        request.META['CSRF_COOKIE_NEEDS_UPDATE'] = True
+        return memo[1]
+    token = django_get_token(request)
+    request._debreach_csrf_token = (request.META['CSRF_COOKIE'], token)
+    return token
+
+
+def unmask_token(token):
+    """
+    Returns the secret from a masked CSRF token, or None if the token isn't
+    a masked token.
+    """
+    if len(token) != CSRF_TOKEN_LENGTH or not token.isascii():
+        return None
+    indexes = token.encode('ascii').translate(_INDEXES)
+    if 0xff in indexes:
+        return None
+    mask = int.from_bytes(indexes[:CSRF_SECRET_LENGTH], 'big')
+    cipher = int.from_bytes(indexes[CSRF_SECRET_LENGTH:], 'big')
+    return (cipher + _OFFSET - mask).to_bytes(
+        CSRF_SECRET_LENGTH, 'big').translate(_CHARACTERS).decode('ascii')
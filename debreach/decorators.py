@@ -1,26 +1,128 @@
-from functools import wraps
+import asyncio
+from functools import partial, wraps
 
-from django.utils.decorators import decorator_from_middleware
+from asgiref.sync import iscoroutinefunction
+from django.core.signals import setting_changed
+from django.http import HttpResponseBase
 
-from debreach.middleware import RandomCommentMiddleware
+from debreach.middleware import (
+    RandomCommentMiddleware, _unused_get_response)
 
 
-append_random_comment = decorator_from_middleware(RandomCommentMiddleware)
-append_random_comment.__name__ = str('append_random_comment')
-append_random_comment.__doc__ = '''
-Applies a random comment to the response of the decorated view in the same
-way as the RandomCommentMiddleware. Using both, or using the decorator
-multiple times is harmless and efficient.
-'''
+_middleware = {}
 
 
-def random_comment_exempt(view_func):
+def _get_middleware(streaming):
     """
-    Marks a view as being exempt from having its response modified by the
-    RandomCommentMiddleware
+    Returns the RandomCommentMiddleware instance shared by all decorated
+    views, with streaming responses padded if ``streaming`` is True.
     """
-    def wrapped_view(*args, **kwargs):
-        response = view_func(*args, **kwargs)
-        response._random_comment_exempt = True
+    middleware = _middleware.get(streaming)
+    if middleware is None:
+        middleware = RandomCommentMiddleware(_unused_get_response)
+        middleware.pad_streaming = middleware.pad_streaming or streaming
+        _middleware[streaming] = middleware
+    return middleware
+
+
+def _reset_middleware(setting, **kwargs):
+    if setting.startswith('DEBREACH_') or setting == 'MIDDLEWARE':
+        _middleware.clear()
+
+
+setting_changed.connect(_reset_middleware)
+
+
+def _pad_response(request, response, streaming):
+    middleware = _middleware.get(streaming) or _get_middleware(streaming)
+    if not getattr(response, 'is_rendered', True):
+        # Defer padding until the template response is rendered.
+        response.add_post_render_callback(
+            partial(middleware.process_response, request))
         return response
+    return middleware.process_response(request, response)
+
+
+async def _pad_awaited_response(request, awaitable, streaming):
+    return _pad_response(request, await awaitable, streaming)
+
+
+def append_random_comment(view_func):
+    """
+    Applies a random comment to the response of the decorated view in the same
+    way as the RandomCommentMiddleware. Using both, or using the decorator
+    multiple times is harmless and efficient. Views marked with
+    ``random_comment_exempt`` are returned as they are.
+    """
+    if getattr(view_func, 'random_comment_exempt', False):
+        return view_func
+    streaming = getattr(view_func, 'random_comment_streaming', False)
+
+    if iscoroutinefunction(view_func):
+        async def wrapped_view(request, *args, **kwargs):
+            return _pad_response(
+                request, await view_func(request, *args, **kwargs),
+                streaming)
+    else:
+        def wrapped_view(request, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            # The dispatch method of an async class-based view returns a
+            # coroutine. Responses are ruled out first, as isinstance is much
+            # cheaper than asyncio.iscoroutine.
+            if not isinstance(response, HttpResponseBase) \
+                    and asyncio.iscoroutine(response):
+                return _pad_awaited_response(request, response, streaming)
+            return _pad_response(request, response, streaming)
     return wraps(view_func)(wrapped_view)
+
+
+async def _mark_awaited_response(awaitable, attribute):
+    response = await awaitable
+    setattr(response, attribute, True)
+    return response
+
+
+def _mark_view(view_func, name):
+    """
+    Returns a thin wrapper around the view with the attribute ``name`` set,
+    for the middleware to find through the resolver match, which also marks
+    each response, so that the mark holds when the view is called directly.
+    The view function itself is left untouched, as it may be routed from
+    elsewhere.
+    """
+    # The attribute marking each response, looked up by the middleware.
+    attribute = '_' + name
+    if iscoroutinefunction(view_func):
+        async def wrapped_view(*args, **kwargs):
+            return await _mark_awaited_response(
+                view_func(*args, **kwargs), attribute)
+    else:
+        def wrapped_view(*args, **kwargs):
+            response = view_func(*args, **kwargs)
+            # As for append_random_comment.
+            if not isinstance(response, HttpResponseBase) \
+                    and asyncio.iscoroutine(response):
+                return _mark_awaited_response(response, attribute)
+            setattr(response, attribute, True)
+            return response
+    wrapped_view = wraps(view_func)(wrapped_view)
+    setattr(wrapped_view, name, True)
+    return wrapped_view
+
+
+def random_comment_exempt(view_func):
+    """
+    Marks a view as being exempt from having its response modified by the
+    RandomCommentMiddleware. To exempt a class-based view decorate its
+    ``dispatch`` method with ``method_decorator``.
+    """
+    return _mark_view(view_func, 'random_comment_exempt')
+
+
+def random_comment_streaming(view_func):
+    """
+    Enables padding of streaming responses returned by the decorated view,
+    regardless of the DEBREACH_PAD_STREAMING setting. To mark a class-based
+    view decorate its ``dispatch`` method with ``method_decorator``.
+    """
+    return _mark_view(view_func, 'random_comment_streaming')
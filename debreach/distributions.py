@@ -0,0 +1,281 @@
+"""
+Distributions of the length of the random data in the padding.
+
+The DEBREACH_PADDING setting is a dict naming a distribution, either one of
+``DISTRIBUTIONS`` or the dotted path to a class, and giving the keyword
+arguments to construct it with. Discrete distributions are sampled from an
+alias table built when the distribution is created, so drawing a length
+costs a single random number whatever the shape of the distribution.
+"""
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from debreach.entropy import get_pool
+
+
+# The resolution of the probabilities stored in an alias table.
+_RESOLUTION = 1 << 16
+
+
+def limit(length, minimum, bound):
+    """
+    Returns ``length`` if it is at most ``bound``, and otherwise a length
+    drawn again uniformly from ``minimum`` to ``bound``, so that a limited
+    length still varies rather than being pinned to the bound.
+    """
+    if length <= bound:
+        return length
+    return minimum + get_pool().randbelow(bound - minimum + 1)
+
+
+class AliasTable:
+    """
+    Samples indexes in proportion to a list of weights in constant time,
+    using Vose's alias method.
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        if not count or total <= 0 or min(weights) < 0:
+            raise ValueError(
+                'weights must be non-negative, with a positive sum.')
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+        thresholds = [_RESOLUTION] * count
+        alias = list(range(count))
+        while small and large:
+            less, more = small.pop(), large.pop()
+            thresholds[less] = round(scaled[less] * _RESOLUTION)
+            alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        self.thresholds = thresholds
+        self.alias = alias
+
+    def sample(self, pool):
+        column, coin = divmod(
+            pool.randbelow(len(self.thresholds) * _RESOLUTION), _RESOLUTION)
+        if coin < self.thresholds[column]:
+            return column
+        return self.alias[column]
+
+
+class _BudgetState:
+
+    def __init__(self):
+        self.padding = 0.0
+        self.body = 0.0
+        self.sent = 0
+        self.scale = 1.0
+
+
+class AdaptiveBudget:
+    """
+    Keeps the padding within ``budget`` percent of the body bytes sent.
+    Exponential moving averages of the padding and body sizes, weighted by
+    ``smoothing``, are kept for each thread, so the hot path takes no lock.
+    The part of each length above ``minimum`` plus ``span`` is scaled by a
+    factor that shrinks with each response while the thread is over budget
+    and grows back towards one while it is under, which narrows the range
+    of large paddings while the lengths within the span still vary.
+    """
+
+    def __init__(self, budget, minimum, smoothing=0.01, span=12):
+        self.budget = budget
+        self.minimum = minimum
+        self.smoothing = smoothing
+        self.span = span
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._states = weakref.WeakSet()
+
+    def _state(self):
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = self._local.state = _BudgetState()
+            with self._lock:
+                self._states.add(state)
+        return state
+
+    def length(self, length, size, overhead=0):
+        """
+        Returns ``length``, narrowed if this thread is over budget, and
+        records it, with the ``overhead`` bytes the padding adds around its
+        random data, as the padding of a body of ``size`` bytes.
+        """
+        state = self._state()
+        if state.padding * 100 > state.body * self.budget:
+            state.scale *= 1 - self.smoothing
+        else:
+            state.scale += self.smoothing * (1 - state.scale)
+        floor = self.minimum + self.span
+        if length > floor:
+            length = floor + int((length - floor) * state.scale)
+        state.padding += self.smoothing * (length + overhead - state.padding)
+        state.body += self.smoothing * (size - state.body)
+        state.sent += size
+        return length
+
+    def ratio(self):
+        """
+        Returns the ratio of padding bytes to body bytes across the threads
+        that have padded responses, weighting each thread by the body bytes
+        it has sent, or None if none have.
+        """
+        with self._lock:
+            states = list(self._states)
+        states = [state for state in states if state.body]
+        sent = sum(state.sent for state in states)
+        if not sent:
+            return None
+        return sum(
+            state.padding / state.body * state.sent for state in states) / sent
+
+
+class Distribution:
+    """
+    The base class of padding length distributions. Lengths are at least
+    ``minimum`` and, if given, at most ``maximum``. If ``cap`` is given, the
+    length is also limited to ``cap`` percent of the size of the body, and if
+    ``budget`` is given, an AdaptiveBudget keeps padding to that percentage
+    of the body bytes on average. Neither limits lengths to less than
+    ``minimum`` plus ``span``, and a limited length is drawn again below the
+    limit, so that the padding of small bodies still varies.
+    """
+
+    def __init__(self, minimum=12, maximum=None, cap=None, budget=None,
+                 smoothing=0.01, span=12):
+        if minimum < 0 or (maximum is not None and maximum < minimum):
+            raise ValueError(
+                'minimum must be non-negative and maximum at least minimum.')
+        if span < 0:
+            raise ValueError('span must be non-negative.')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cap = cap
+        self.span = span
+        self.budget = None if budget is None else AdaptiveBudget(
+            budget, minimum, smoothing, span)
+
+    def sample(self, size):
+        """
+        Returns a length of at least ``minimum`` for a body of ``size``
+        bytes, which is None if the size isn't known.
+        """
+        raise NotImplementedError
+
+    def length(self, size=None, overhead=0):
+        """
+        Returns a length for the padding of a body of ``size`` bytes, which
+        adds ``overhead`` bytes around its random data.
+        """
+        length = self.sample(size)
+        if size is not None:
+            if self.cap is not None:
+                length = limit(length, self.minimum, max(
+                    self.minimum + self.span, size * self.cap // 100))
+            if self.budget is not None:
+                length = self.budget.length(length, size, overhead)
+        return length
+
+
+class TableDistribution(Distribution):
+    """
+    Draws lengths from ``minimum`` upwards in proportion to ``weights``.
+    """
+
+    def __init__(self, weights, minimum=12, maximum=None, **kwargs):
+        super().__init__(minimum, maximum, **kwargs)
+        self.table = AliasTable(weights)
+
+    def sample(self, size):
+        return self.minimum + self.table.sample(get_pool())
+
+
+class UniformDistribution(TableDistribution):
+    """
+    Draws lengths uniformly from ``minimum`` to ``maximum`` inclusive.
+    """
+
+    def __init__(self, minimum=12, maximum=24, **kwargs):
+        super().__init__(
+            [1] * (maximum - minimum + 1), minimum, maximum, **kwargs)
+
+
+class GeometricDistribution(TableDistribution):
+    """
+    Draws lengths from ``minimum`` to ``maximum`` inclusive with a geometric
+    tail, so that on average lengths are ``mean`` more than the minimum
+    before truncation.
+    """
+
+    def __init__(self, minimum=12, maximum=1024, mean=32, **kwargs):
+        ratio = mean / (mean + 1)
+        super().__init__(
+            [ratio ** i for i in range(maximum - minimum + 1)],
+            minimum, maximum, **kwargs)
+
+
+class ProportionalDistribution(Distribution):
+    """
+    Draws lengths uniformly from ``minimum`` to ``minimum`` plus ``percent``
+    percent of the size of the body, or exactly ``minimum`` for a body of
+    unknown size.
+    """
+
+    def __init__(self, minimum=12, maximum=None, percent=1, **kwargs):
+        super().__init__(minimum, maximum, **kwargs)
+        self.percent = percent
+
+    def sample(self, size):
+        span = int(size * self.percent / 100) if size else 0
+        if self.maximum is not None:
+            span = min(span, self.maximum - self.minimum)
+        if not span:
+            return self.minimum
+        return self.minimum + get_pool().randbelow(span + 1)
+
+
+DISTRIBUTIONS = {
+    'uniform': UniformDistribution,
+    'geometric': GeometricDistribution,
+    'proportional': ProportionalDistribution,
+}
+
+DEFAULT_PADDING = {
+    'distribution': 'uniform',
+    'minimum': 12,
+    'maximum': 24,
+}
+
+
+_distribution = None
+
+
+def get_distribution():
+    """
+    Returns the distribution configured by the DEBREACH_PADDING setting.
+    """
+    global _distribution
+    distribution = _distribution
+    if distribution is None:
+        options = dict(getattr(settings, 'DEBREACH_PADDING', DEFAULT_PADDING))
+        name = options.pop('distribution', 'uniform')
+        distribution_class = DISTRIBUTIONS.get(name) or import_string(name)
+        distribution = _distribution = distribution_class(**options)
+    return distribution
+
+
+def _reset_distribution(setting, **kwargs):
+    global _distribution
+    if setting == 'DEBREACH_PADDING':
+        _distribution = None
+
+
+setting_changed.connect(_reset_distribution)
@@ -0,0 +1,135 @@
+"""
+A buffered source of cryptographically secure random data.
+
+Random bytes are read from ``os.urandom`` in large batches into a per-thread
+buffer, so generating the padding for a response costs a slice and a
+``bytes.translate`` call rather than a system call per character. Buffers are
+discarded in the child after a fork so that processes never share random
+data.
+"""
+import os
+import string
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+
+ALPHABET = (string.ascii_letters + string.digits).encode('ascii')
+
+# Maps each byte onto a character of the alphabet. Bytes at or above the
+# largest multiple of the alphabet size are deleted rather than mapped, so
+# every character is equally likely.
+_LIMIT = 256 - 256 % len(ALPHABET)
+_TRANSLATION = bytes(ALPHABET[b % len(ALPHABET)] for b in range(256))
+_REJECTED = bytes(range(_LIMIT, 256))
+
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_LOW_WATER = 64
+
+_generation = 0
+
+
+def _after_fork_in_child():
+    global _generation
+    _generation += 1
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class EntropyPool(threading.local):
+    """
+    A per-thread buffer of random bytes, refilled with ``batch_size`` bytes
+    from ``os.urandom`` whenever fewer than ``low_water`` bytes remain.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE,
+                 low_water=DEFAULT_LOW_WATER):
+        if batch_size < 1 or low_water < 0:
+            raise ValueError(
+                'batch_size must be positive and low_water non-negative.')
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.buffer = b''
+        self.offset = 0
+        self.generation = _generation
+
+    def refill(self, size=0):
+        if self.generation != _generation:
+            # Never hand out bytes that were read before a fork.
+            self.buffer = b''
+            self.offset = 0
+            self.generation = _generation
+        self.buffer = self.buffer[self.offset:] + os.urandom(
+            max(self.batch_size, size))
+        self.offset = 0
+
+    def read(self, size):
+        """
+        Returns ``size`` random bytes.
+        """
+        if self.generation != _generation \
+                or len(self.buffer) - self.offset < max(size, self.low_water):
+            self.refill(size)
+        start = self.offset
+        self.offset += size
+        return self.buffer[start:self.offset]
+
+    def randbelow(self, n):
+        """
+        Returns a random integer in the range ``[0, n)``.
+        """
+        if n < 1:
+            raise ValueError('n must be positive.')
+        size = max(1, ((n - 1).bit_length() + 7) // 8)
+        limit = (256 ** size) // n * n
+        while True:
+            value = int.from_bytes(self.read(size), 'big')
+            if value < limit:
+                return value % n
+
+    def random_bytes(self, length):
+        """
+        Returns ``length`` random letters and digits, as ASCII bytes.
+        """
+        chars = self.read(length).translate(_TRANSLATION, _REJECTED)
+        while len(chars) < length:
+            chars += self.read(length - len(chars)).translate(
+                _TRANSLATION, _REJECTED)
+        return chars
+
+    def random_string(self, length):
+        """
+        Returns a random string of ``length`` letters and digits.
+        """
+        return self.random_bytes(length).decode('ascii')
+
+
+_pool = None
+
+
+def get_pool():
+    """
+    Returns the shared pool, configured by the DEBREACH_ENTROPY_BATCH_SIZE
+    and DEBREACH_ENTROPY_LOW_WATER settings.
+    """
+    global _pool
+    pool = _pool
+    if pool is None:
+        pool = _pool = EntropyPool(
+            batch_size=getattr(
+                settings, 'DEBREACH_ENTROPY_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            low_water=getattr(
+                settings, 'DEBREACH_ENTROPY_LOW_WATER', DEFAULT_LOW_WATER))
+    return pool
+
+
+def _reset_pool(setting, **kwargs):
+    global _pool
+    if setting.startswith('DEBREACH_ENTROPY_'):
+        _pool = None
+
+
+setting_changed.connect(_reset_pool)
@@ -0,0 +1,104 @@
+"""
+Path and URL name based exemption from padding, configured by the
+DEBREACH_EXEMPT_PATHS, DEBREACH_EXEMPT_URL_NAMES and DEBREACH_INCLUDE_PATHS
+settings. The settings are compiled once into an index, which is rebuilt if
+they change.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+
+
+_END = object()
+
+
+class PrefixTrie:
+    """
+    A character trie of path prefixes, matched in O(path length) however many
+    prefixes it holds.
+    """
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def add(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_END] = True
+
+    def matches(self, path):
+        """
+        Returns True if any prefix in the trie is a prefix of ``path``.
+        """
+        node = self.root
+        if _END in node:
+            return True
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+class ExemptionIndex:
+
+    def __init__(self, exempt_paths=(), exempt_url_names=(),
+                 include_paths=()):
+        self.exempt_paths = PrefixTrie(exempt_paths)
+        self.exempt_url_names = frozenset(exempt_url_names)
+        self.include_paths = PrefixTrie(include_paths)
+
+    def is_exempt(self, request):
+        """
+        Returns True if the response to the request shouldn't be padded.
+        """
+        path = request.path_info
+        if self.include_paths and not self.include_paths.matches(path):
+            return True
+        if self.exempt_paths and self.exempt_paths.matches(path):
+            return True
+        if self.exempt_url_names:
+            match = getattr(request, 'resolver_match', None)
+            if match is not None and (
+                    match.url_name in self.exempt_url_names
+                    or match.view_name in self.exempt_url_names):
+                return True
+        return False
+
+
+_index = None
+
+
+def get_index():
+    """
+    Returns the exemption index compiled from the current settings, or None
+    if no exemptions are configured.
+    """
+    global _index
+    if _index is None:
+        _index = ExemptionIndex(
+            exempt_paths=getattr(settings, 'DEBREACH_EXEMPT_PATHS', ()),
+            exempt_url_names=getattr(
+                settings, 'DEBREACH_EXEMPT_URL_NAMES', ()),
+            include_paths=getattr(settings, 'DEBREACH_INCLUDE_PATHS', ()))
+        if not (_index.exempt_paths or _index.exempt_url_names
+                or _index.include_paths):
+            _index = False
+    return _index or None
+
+
+def _reset_index(setting, **kwargs):
+    global _index
+    if setting in ('DEBREACH_EXEMPT_PATHS', 'DEBREACH_EXEMPT_URL_NAMES',
+                   'DEBREACH_INCLUDE_PATHS'):
+        _index = None
+
+
+setting_changed.connect(_reset_index)
@@ -0,0 +1,89 @@
+"""
+Padding for responses that stream a file, such as FileResponse.
+
+Django hands the file of a FileResponse to the server's ``wsgi.file_wrapper``,
+which may send it with ``sendfile`` and would then never send padding added
+to the response's streaming content. Instead the file is wrapped in a
+PaddedFile, which reads as the file followed by the padding, and under WSGI
+the request's ``wsgi.file_wrapper`` is replaced by one that hands the file
+itself, ``fileno`` and all, to the server's wrapper, and sends the padding
+after it. Without a ``wsgi.file_wrapper`` the PaddedFile is read in blocks.
+"""
+from functools import partial
+
+
+FILE_WRAPPER_KEY = 'wsgi.file_wrapper'
+
+
+class PaddedFile:
+    """
+    A read-only file-like object reading as the contents of ``file``
+    followed by ``padding``. Once the file is exhausted, the next read
+    returns the padding.
+    """
+
+    def __init__(self, file, padding):
+        self.file = file
+        self.padding = padding
+        self.name = getattr(file, 'name', '')
+        self._remaining = padding
+        self._exhausted = False
+
+    def read(self, size=-1):
+        data = b''
+        if not self._exhausted:
+            data = self.file.read(size)
+            if data and size is not None and size >= 0:
+                return data
+            self._exhausted = True
+        data, self._remaining = data + self._remaining, b''
+        return data
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+
+class PaddedFileWrapper:
+    """
+    The WSGI response iterable for a PaddedFile: the server's file wrapper
+    of the file itself, followed by the padding.
+    """
+
+    def __init__(self, wrapper, padded):
+        self.wrapper = wrapper
+        self.padded = padded
+
+    def __iter__(self):
+        yield from self.wrapper
+        yield self.padded.padding
+
+    def close(self):
+        try:
+            if hasattr(self.wrapper, 'close'):
+                self.wrapper.close()
+        finally:
+            self.padded.close()
+
+
+def padded_file_wrapper(file_wrapper, filelike, block_size=8192):
+    """
+    Calls the server's ``file_wrapper`` with the file inside ``filelike`` if
+    it is a PaddedFile, so the server can still send the file with
+    ``sendfile``, and returns a PaddedFileWrapper that adds the padding.
+    """
+    if not isinstance(filelike, PaddedFile):
+        return file_wrapper(filelike, block_size)
+    return PaddedFileWrapper(
+        file_wrapper(filelike.file, block_size), filelike)
+
+
+def wrap_file_wrapper(environ):
+    """
+    Replaces the ``wsgi.file_wrapper`` in the WSGI ``environ``, if there is
+    one, with ``padded_file_wrapper``.
+    """
+    file_wrapper = environ.get(FILE_WRAPPER_KEY)
+    if file_wrapper is not None \
+            and getattr(file_wrapper, 'func', None) is not padded_file_wrapper:
+        environ[FILE_WRAPPER_KEY] = partial(padded_file_wrapper, file_wrapper)
@@ -0,0 +1,32 @@
+"""
+A Jinja2 extension providing the ``{% debreach_pad %}`` tag, which works in
+the same way as the Django template tag of the same name. Enable it in the
+``extensions`` option of the Jinja2 template backend::
+
+    'OPTIONS': {
+        'extensions': ['debreach.jinja2ext.DebreachExtension'],
+    }
+"""
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from debreach.padding import PLACEHOLDER
+from debreach.utils import mark_placeholder
+
+
+class DebreachExtension(Extension):
+
+    tags = {'debreach_pad'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        return nodes.Output([
+            self.call_method('_pad', [nodes.ContextReference()]),
+        ], lineno=lineno)
+
+    def _pad(self, context):
+        request = context.get('request')
+        if request is not None:
+            mark_placeholder(request)
+        return Markup(PLACEHOLDER)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from debreach.middleware import (
+    RandomCommentMiddleware, _unused_get_response)
+from debreach.padding import encode_padding, get_registry
+
+
+MANIFEST_VERSION = 1
+
+
+def _setup_worker():
+    # Workers that are spawned, rather than forked, start without Django.
+    django.setup()
+
+
+def policy():
+    """
+    Returns the settings that determine the padding, so that every file is
+    padded again when they change.
+    """
+    return json.loads(json.dumps({
+        'padding': getattr(settings, 'DEBREACH_PADDING', None),
+        'content_types': getattr(settings, 'DEBREACH_CONTENT_TYPES', None),
+        'insertion_points': getattr(
+            settings, 'DEBREACH_INSERTION_POINTS', None),
+        'insertion_scan_limit': getattr(
+            settings, 'DEBREACH_INSERTION_SCAN_LIMIT', None),
+        'large_body_size': getattr(
+            settings, 'DEBREACH_LARGE_BODY_SIZE', None),
+        'charset': settings.DEFAULT_CHARSET,
+    }, default=str))
+
+
+def variant_name(name, index):
+    root, ext = os.path.splitext(name)
+    return '{0}.{1}{2}'.format(root, index, ext)
+
+
+def write_atomic(path, write):
+    """
+    Writes a file by calling ``write`` with a temporary file in the same
+    directory, then renaming it over ``path``, so that a server never reads
+    a partly written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.debreach-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def prepad(source, output, name, variants, digest=None):
+    """
+    Writes ``variants`` padded copies of the file ``name`` in ``source`` to
+    ``output``. The file is memory-mapped, so neither it nor the variants
+    are ever held in memory whole. Returns the name, the SHA-256 digest of
+    the file, its size, and the names of the variants written, which is
+    None if the digest was ``digest`` and nothing was written.
+    """
+    with open(os.path.join(source, name), 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+            if size else b''
+    try:
+        file_digest = hashlib.sha256(body).hexdigest()
+        if file_digest == digest:
+            return name, file_digest, size, None
+        middleware = RandomCommentMiddleware(_unused_get_response)
+        charset = settings.DEFAULT_CHARSET
+        strategy = get_registry().strategy(
+            'text/html; charset={0}'.format(charset))
+        points, width = (), 0
+        if size and strategy is not None:
+            # Padding replaces any debreach_pad placeholders left in the file
+            # when it was rendered.
+            points, width = middleware.padding_points(body, strategy, charset)
+            if points:
+                # As for responses, a cap applies to the whole body.
+                length = (size - width * len(points)) // len(points)
+            else:
+                points, length = [size], size
+        names = []
+        with memoryview(body) as view:
+            for index in range(variants):
+                paddings = ()
+                if points:
+                    paddings = [
+                        encode_padding(
+                            strategy, middleware.length(length, strategy),
+                            charset)
+                        for _ in points]
+
+                def write(f):
+                    start = 0
+                    for point, padding in zip(points, paddings):
+                        f.write(view[start:point])
+                        f.write(padding)
+                        start = point + width
+                    f.write(view[start:])
+
+                names.append(variant_name(name, index))
+                write_atomic(os.path.join(output, names[-1]), write)
+        return name, file_digest, size, names
+    finally:
+        if size:
+            body.close()
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Writes padded variants of each HTML file in a directory, with the '
+        'same padding as RandomCommentMiddleware, and a manifest of them '
+        'from which a front-end server can choose a variant at random.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='The directory of HTML files.')
+        parser.add_argument(
+            'output', help='The directory to write the variants to.')
+        parser.add_argument(
+            '--variants', type=int, default=8,
+            help='The number of padded variants per file (default: 8).')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='The number of worker processes (default: the number of '
+                 'CPUs). With 1, files are padded in this process.')
+        parser.add_argument(
+            '--extension', action='append', dest='extensions',
+            help='The extension of the files to pad, which may be given '
+                 'more than once (default: .html and .htm).')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Pad every file, even if it is unchanged.')
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['source'])
+        output = os.path.abspath(options['output'])
+        if not os.path.isdir(source):
+            raise CommandError('{0} is not a directory.'.format(source))
+        if output == source:
+            raise CommandError(
+                'The output directory must differ from the source.')
+        if options['variants'] < 1 or options['workers'] < 1:
+            raise CommandError('--variants and --workers must be positive.')
+        extensions = tuple(
+            extension.lower()
+            for extension in options['extensions'] or ('.html', '.htm'))
+        manifest_path = os.path.join(output, 'manifest.json')
+        manifest = self.load_manifest(manifest_path)
+        previous = manifest['files']
+        if options['force'] or manifest['variants'] != options['variants'] \
+                or manifest['policy'] != policy():
+            digests = {}
+        else:
+            digests = {
+                name: entry['sha256'] for name, entry in previous.items()
+                if all(os.path.exists(os.path.join(output, variant))
+                       for variant in entry['variants'])}
+        names = self.find_files(source, output, extensions)
+        tasks = [
+            (source, output, name, options['variants'], digests.get(name))
+            for name in names]
+        if options['workers'] == 1:
+            results = [prepad(*task) for task in tasks]
+        else:
+            # Forked workers draw their padding from fresh random data, as
+            # the entropy pool is discarded after a fork.
+            with ProcessPoolExecutor(
+                    options['workers'], initializer=_setup_worker) as executor:
+                results = list(executor.map(
+                    prepad, *zip(*tasks), chunksize=16)) if tasks else []
+        files = {}
+        padded = 0
+        for name, digest, size, variants in results:
+            if variants is None:
+                files[name] = previous[name]
+                continue
+            padded += 1
+            files[name] = {
+                'sha256': digest, 'size': size, 'variants': variants}
+        removed = 0
+        for name, entry in previous.items():
+            stale = set(entry['variants']) - set(
+                files.get(name, {}).get('variants', ()))
+            for variant in stale:
+                try:
+                    os.unlink(os.path.join(output, variant))
+                except FileNotFoundError:
+                    pass
+            removed += name not in files
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'variants': options['variants'],
+            'policy': policy(),
+            'files': files,
+        }
+        write_atomic(manifest_path, lambda f: f.write(
+            json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')))
+        self.stdout.write(
+            '{0} padded, {1} unchanged, {2} removed.'.format(
+                padded, len(files) - padded, removed))
+
+    def load_manifest(self, path):
+        try:
+            with open(path, 'rb') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = None
+        except ValueError:
+            raise CommandError('{0} is not a valid manifest.'.format(path))
+        if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+            manifest = {'variants': None, 'policy': None, 'files': {}}
+        return manifest
+
+    def find_files(self, source, output, extensions):
+        """
+        Returns the paths, relative to ``source`` and using forward slashes,
+        of the files to pad, skipping the output directory if it is inside
+        ``source``.
+        """
+        names = []
+        for directory, subdirectories, filenames in os.walk(source):
+            subdirectories[:] = sorted(
+                subdirectory for subdirectory in subdirectories
+                if os.path.join(directory, subdirectory) != output)
+            for filename in sorted(filenames):
+                if filename.lower().endswith(extensions):
+                    names.append(os.path.relpath(
+                        os.path.join(directory, filename), source,
+                    ).replace(os.sep, '/'))
+        return names
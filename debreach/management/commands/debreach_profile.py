@@ -0,0 +1,150 @@
+import cProfile
+import logging
+import os
+import statistics
+import tracemalloc
+from time import perf_counter_ns
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import NoReverseMatch, reverse
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Requests each of the given URL names or paths through the test '
+        'client with and without the debreach middleware, and reports '
+        'latency percentiles, allocations and the bytes added.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls', nargs='+', metavar='url',
+            help='A URL name, or a path starting with "/".')
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='The number of timed requests per URL (default: 100).')
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='The number of untimed requests per URL (default: 5).')
+        parser.add_argument(
+            '--middleware',
+            default='debreach.middleware.RandomCommentMiddleware',
+            help='The middleware to profile, placed at the start of '
+                 'MIDDLEWARE.')
+        parser.add_argument(
+            '--profile-dir',
+            help='Write a cProfile dump of the requests made with the '
+                 'middleware for each URL to this directory.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2.')
+        paths = [self.resolve(url) for url in options['urls']]
+        if options['profile_dir']:
+            os.makedirs(options['profile_dir'], exist_ok=True)
+        middleware = [
+            path for path in settings.MIDDLEWARE
+            if not path.startswith('debreach.')]
+        stacks = (
+            ('without', middleware),
+            ('with', [options['middleware']] + middleware),
+        )
+        hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+        # Don't log a warning for every request to a URL that returns an
+        # error status; it is reported once below.
+        logger = logging.getLogger('django.request')
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            self.profile_urls(options, paths, stacks, hosts)
+        finally:
+            logger.setLevel(level)
+
+    def profile_urls(self, options, paths, stacks, hosts):
+        self.stdout.write(
+            '{0:<30} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+                'url', 'debreach', 'p50 (us)', 'p90 (us)', 'p99 (us)',
+                'peak (KB)', 'bytes'))
+        for url, path in zip(options['urls'], paths):
+            sizes = {}
+            for label, stack in stacks:
+                with override_settings(
+                        MIDDLEWARE=stack, ALLOWED_HOSTS=hosts):
+                    client = Client()
+                    profile = None
+                    if options['profile_dir'] and label == 'with':
+                        profile = cProfile.Profile()
+                    result = self.profile(client, path, options, profile)
+                if profile is not None:
+                    profile.dump_stats(os.path.join(
+                        options['profile_dir'],
+                        '{0}.prof'.format(self.slug(url))))
+                sizes[label] = result['size']
+                self.stdout.write(
+                    '{0:<30} {1:>8} {2:>10.1f} {3:>10.1f} {4:>10.1f} '
+                    '{5:>10.1f} {6:>10.1f}'.format(
+                        url, label, *result['percentiles'],
+                        result['peak'] / 1024, result['size']))
+                if result['status'] != 200:
+                    self.stderr.write('{0} returned status {1}.'.format(
+                        url, result['status']))
+            self.stdout.write('{0:<30} {1:>8} {2:>54.1f}'.format(
+                url, 'added', sizes['with'] - sizes['without']))
+
+    def resolve(self, url):
+        if url.startswith('/'):
+            return url
+        try:
+            return reverse(url)
+        except NoReverseMatch:
+            raise CommandError(
+                '{0!r} is neither a path nor a URL name that can be '
+                'reversed without arguments.'.format(url))
+
+    def slug(self, url):
+        return url.strip('/').replace('/', '_').replace(':', '_') or 'root'
+
+    def profile(self, client, path, options, profile=None):
+        """
+        Returns the 50th, 90th and 99th percentile latencies in
+        microseconds, the median peak memory allocated per request in bytes,
+        and the mean body size, for ``path``.
+        """
+        for _ in range(options['warmup']):
+            client.get(path)
+        times = []
+        sizes = []
+        for _ in range(options['requests']):
+            start = perf_counter_ns()
+            response = client.get(path)
+            times.append(perf_counter_ns() - start)
+            sizes.append(len(response.content))
+        # Allocations and profiles are collected in separate passes, as
+        # tracing slows the requests down.
+        if profile is not None:
+            profile.enable()
+            try:
+                for _ in range(options['requests']):
+                    client.get(path)
+            finally:
+                profile.disable()
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(min(options['requests'], 20)):
+                current = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                client.get(path)
+                peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        finally:
+            tracemalloc.stop()
+        percentiles = statistics.quantiles(times, n=100, method='inclusive')
+        return {
+            'percentiles': [
+                percentiles[index] / 1000 for index in (49, 89, 98)],
+            'peak': statistics.median(peaks),
+            'size': statistics.mean(sizes),
+            'status': response.status_code,
+        }
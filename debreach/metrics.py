@@ -0,0 +1,153 @@
+"""
+Counters, and the collectors that record what the middleware does.
+
+A collector is told about every response the middleware processes: through
+``padded(length, duration_ns)`` when padding was added, with its length in
+bytes, and through ``skipped(reason, duration_ns)`` otherwise. Durations are
+measured with ``time.perf_counter_ns``. The DEBREACH_COLLECTOR setting gives
+the dotted path to a collector class; by default the NullCollector is used,
+and the middleware doesn't time responses at all.
+"""
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+
+class Counters:
+    """
+    A thread-safe set of named counters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+counters = Counters()
+
+
+class Histogram:
+    """
+    A thread-safe histogram of non-negative integers, with power of two
+    buckets. Each bucket is keyed by its inclusive upper bound.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def observe(self, value):
+        bucket = value.bit_length()
+        with self._lock:
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self._count,
+                'sum': self._sum,
+                'buckets': {
+                    (1 << bucket) - 1: count
+                    for bucket, count in sorted(self._buckets.items())},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._buckets = {}
+            self._count = 0
+            self._sum = 0
+
+
+class NullCollector:
+    """
+    Discards everything. While it is the configured collector the
+    middleware skips timing responses.
+    """
+
+    enabled = False
+
+    def padded(self, length, duration_ns):
+        pass
+
+    def skipped(self, reason, duration_ns):
+        pass
+
+    def snapshot(self):
+        return {}
+
+    def reset(self):
+        pass
+
+
+class InProcessCollector:
+    """
+    Keeps counts of padded and skipped responses, by reason, the total
+    number of padding bytes, and a histogram of the time taken per response
+    in nanoseconds, in the memory of the current process.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.counters = Counters()
+        self.durations = Histogram()
+
+    def padded(self, length, duration_ns):
+        self.counters.increment('padded')
+        self.counters.increment('padding_bytes', length)
+        self.durations.observe(duration_ns)
+
+    def skipped(self, reason, duration_ns):
+        self.counters.increment('skipped_' + reason)
+        self.durations.observe(duration_ns)
+
+    def snapshot(self):
+        return {
+            'counters': self.counters.snapshot(),
+            'duration_ns': self.durations.snapshot(),
+        }
+
+    def reset(self):
+        self.counters.reset()
+        self.durations.reset()
+
+
+_collector = None
+
+
+def get_collector():
+    """
+    Returns the collector configured by the DEBREACH_COLLECTOR setting.
+    """
+    global _collector
+    collector = _collector
+    if collector is None:
+        path = getattr(settings, 'DEBREACH_COLLECTOR', None)
+        collector = _collector = \
+            import_string(path)() if path else NullCollector()
+    return collector
+
+
+def _reset_collector(setting, **kwargs):
+    global _collector
+    if setting == 'DEBREACH_COLLECTOR':
+        _collector = None
+
+
+setting_changed.connect(_reset_collector)
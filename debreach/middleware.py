@@ -1,28 +1,645 @@
+import hashlib
 import logging
-import random
+from time import perf_counter_ns
 
-from django.utils.crypto import get_random_string
-from django.utils.deprecation import MiddlewareMixin
-from django.utils.encoding import force_str
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware, re_accepts_gzip
+from django.utils.cache import (
+    cc_delim_re, get_conditional_response, patch_vary_headers)
+from django.utils.http import parse_http_date_safe, quote_etag
+
+from debreach.checks import GZIP_MIDDLEWARE, PADDING_MIDDLEWARE
+from debreach.compression import COMPRESSORS, DEFAULT_LEVELS, select_coding
+from debreach.csrf import unmask_token
+from debreach.distributions import get_distribution
+from debreach.exemptions import get_index
+from debreach.files import PaddedFile, wrap_file_wrapper
+from debreach.metrics import counters, get_collector
+from debreach.padding import (
+    DEFAULT_SCAN_LIMIT, ENCODED_PADDING, OVERHEAD, PLACEHOLDER, STRATEGIES,
+    InsertionScanner, encode_padding, get_registry)
+from debreach.utils import is_sensitive
 
 
 log = logging.getLogger(__name__)
 
+DEFAULT_LARGE_BODY_SIZE = 1024 * 1024
+
+# GZipMiddleware doesn't compress shorter bodies, and neither does
+# RandomCommentCompressionMiddleware.
+_GZIP_MINIMUM_LENGTH = 200
+
+
+def native_mitigation():
+    """
+    Returns True if GZipMiddleware is installed outside the padding
+    middleware and randomises the length of the responses it compresses, as
+    it does from Django 4.2.
+    """
+    middleware = list(settings.MIDDLEWARE or ())
+    if GZIP_MIDDLEWARE not in middleware \
+            or not getattr(GZipMiddleware, 'max_random_bytes', 0):
+        return False
+    padding = [path for path in middleware if path in PADDING_MIDDLEWARE]
+    return not padding \
+        or middleware.index(GZIP_MIDDLEWARE) < middleware.index(padding[0])
+
+
+def _unused_get_response(request):
+    # For middleware instances that only process responses, as for the
+    # decorators and the debreach_prepad command.
+    raise NotImplementedError
+
+
+def _pad_iterator(content, comment):
+    padded = False
+    for chunk in content:
+        padded = padded or bool(chunk)
+        yield chunk
+    if padded:
+        yield comment
+
+
+async def _pad_async_iterator(content, comment):
+    padded = False
+    async for chunk in content:
+        padded = padded or bool(chunk)
+        yield chunk
+    if padded:
+        yield comment
+
+
+class _Applied:
+    """
+    Marks a response as padded. The marker is truthy, but unpickles as
+    ``False`` so that a response restored from a cache is padded again.
+    """
+
+    def __bool__(self):
+        return True
+
+    def __reduce__(self):
+        return (bool, ())
+
+
+APPLIED = _Applied()
+
+
+class _PaddedContainer(list):
+    """
+    The chunk list of a padded response. It is pickled as the chunk list of
+    the unpadded body, so caches store the body without its padding.
+    """
+
+    def __reduce__(self):
+        return (list, (self.unpadded,))
+
+
+def _append_padding(response, padding):
+    container = _PaddedContainer(response._container)
+    container.unpadded = response._container
+    container.append(padding)
+    response._container = container
+    response.__dict__.pop('text', None)
+
+
+def _find_all(body, needle):
+    points = []
+    point = body.find(needle)
+    while point != -1:
+        points.append(point)
+        point = body.find(needle, point + len(needle))
+    return points
+
+
+def _insert_padding(response, body, points, paddings, width=0):
+    """
+    Inserts each padding at the matching offset in the body of the response,
+    in place of the ``width`` bytes there, building the padded body with a
+    single join. Returns the padding inserted.
+    """
+    view = memoryview(body)
+    pieces = []
+    start = 0
+    for point, padding in zip(points, paddings):
+        pieces.append(view[start:point])
+        pieces.append(padding)
+        start = point + width
+    pieces.append(view[start:])
+    container = _PaddedContainer([b''.join(pieces)])
+    container.unpadded = [body]
+    response._container = container
+    response.__dict__.pop('text', None)
+    return b''.join(paddings)
+
+
+def _set_etag(response):
+    # The same ETag as django.utils.cache.set_response_etag, hashed a chunk
+    # at a time rather than over a joined copy of the body.
+    digest = hashlib.md5(usedforsecurity=False)
+    for chunk in response:
+        digest.update(chunk)
+    response['ETag'] = quote_etag(digest.hexdigest())
+
+
+def _weaken_etag(response):
+    # A padded body is no longer byte-for-byte identical to the content a
+    # strong ETag describes.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class RandomCommentMiddleware:
+    """
+    Appends a random comment to HTML responses. Supports both sync and async
+    middleware chains natively, so under ASGI the response is processed on
+    the event loop without a thread hop.
+    """
+
+    sync_capable = True
+    async_capable = True
 
-class RandomCommentMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        if get_response is None:
+            raise ValueError('get_response must be provided.')
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.pad_streaming = getattr(
+            settings, 'DEBREACH_PAD_STREAMING', False)
+        self.pad_files = getattr(settings, 'DEBREACH_PAD_FILES', False)
+        self.etag = getattr(settings, 'DEBREACH_ETAG', None)
+        if self.etag is None:
+            self.etag = 'django.middleware.http.ConditionalGetMiddleware' \
+                in settings.MIDDLEWARE
+        self.sensitive_only = getattr(
+            settings, 'DEBREACH_PAD_SENSITIVE_ONLY', False)
+        self.collector = get_collector()
+        self.distribution = get_distribution()
+        self.large_body_size = getattr(
+            settings, 'DEBREACH_LARGE_BODY_SIZE', DEFAULT_LARGE_BODY_SIZE)
+        markers = getattr(settings, 'DEBREACH_INSERTION_POINTS', ())
+        self.scanner = InsertionScanner(markers, getattr(
+            settings, 'DEBREACH_INSERTION_SCAN_LIMIT', DEFAULT_SCAN_LIMIT)) \
+            if markers else None
+        self.scan_placeholders = getattr(
+            settings, 'DEBREACH_SCAN_PLACEHOLDERS', False)
+        self.native = getattr(settings, 'DEBREACH_NATIVE_MITIGATION', None)
+        if self.native is None:
+            self.native = native_mitigation()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def can_pad(self, request, response):
+        """
+        Returns True if the response is one that should be padded.
+        """
+        return self.skip_reason(request, response) is None
+
+    def skip_reason(self, request, response):
+        """
+        Returns the reason the response shouldn't be padded, or None if it
+        should be.
+        """
+        index = get_index()
+        if index is not None and index.is_exempt(request):
+            return 'exempt'
+        match = getattr(request, 'resolver_match', None)
+        view_func = match.func if match is not None else None
+        if getattr(view_func, 'random_comment_exempt', False) \
+                or getattr(response, '_random_comment_exempt', False):
+            return 'exempt'
+        if getattr(response, '_random_comment_applied', False):
+            return 'applied'
+        if get_registry().strategy(response.get('Content-Type', '')) is None:
+            return 'content_type'
+        # Responses that GZipMiddleware will compress already have their
+        # length randomised.
+        if self.native and not response.has_header('Content-Encoding') \
+                and re_accepts_gzip.search(
+                    request.META.get('HTTP_ACCEPT_ENCODING', '')) \
+                and (getattr(response, 'streaming', False)
+                     or sum(map(len, response)) >= _GZIP_MINIMUM_LENGTH):
+            return 'native'
+        # Padding a partial response would corrupt the range it describes.
+        if response.status_code == 206 or response.has_header('Content-Range'):
+            return 'range'
+        if getattr(response, 'streaming', False) and not (
+                self.pad_streaming
+                or (self.pad_files
+                    and getattr(response, 'file_to_stream', None) is not None)
+                or getattr(view_func, 'random_comment_streaming', False)
+                or getattr(response, '_random_comment_streaming', False)):
+            return 'streaming'
+        if self.sensitive_only:
+            if not is_sensitive(request, response):
+                counters.increment('skipped_insensitive')
+                return 'insensitive'
+            counters.increment('sensitive')
+        return None
 
     def process_response(self, request, response):
-        if not getattr(response, 'streaming', False) \
-                and response.get('Content-Type', '').startswith('text/html') \
-                and response.content \
-                and isinstance(response.content, (bytes, str)) \
-                and not getattr(response, '_random_comment_exempt', False) \
-                and not getattr(response, '_random_comment_applied', False):
-            comment = '<!-- {0} -->'.format(
-                get_random_string(random.choice(range(12, 25))))
-            response.content = '{0}{1}'.format(
-                force_str(response.content), comment)
-            response._random_comment_applied = True
-            if response.has_header('Content-Length'):
-                response['Content-Length'] = str(len(response.content))
+        collector = self.collector
+        if not collector.enabled:
+            return self.pad(request, response)[0]
+        start = perf_counter_ns()
+        response, padding, reason = self.pad(request, response)
+        duration = perf_counter_ns() - start
+        if padding is None:
+            collector.skipped(reason, duration)
+        else:
+            collector.padded(len(padding), duration)
+        return response
+
+    def pad(self, request, response):
+        """
+        Pads the response if it should be. Returns the response, the padding
+        added to it, or None, and the reason it wasn't padded, or None.
+        """
+        return self.apply_padding(
+            request, response, self.skip_reason(request, response))
+
+    def apply_padding(self, request, response, reason, conditional=True):
+        """
+        Pads the response unless ``reason``, as returned by ``skip_reason``,
+        says it shouldn't be. The conditional GET check is skipped if
+        ``conditional`` is False, as when the caller has already run it.
+        Returns the same values as ``pad``.
+        """
+        if reason is not None:
+            return response, None, reason
+        if getattr(response, 'file_to_stream', None) is not None:
+            return self.pad_file_response(request, response)
+        if getattr(response, 'streaming', False):
+            return self.pad_streaming_response(response)
+        # Iterating the response walks its internal chunk list, so checking
+        # for an empty body never has to join the chunks together.
+        if not any(response):
+            return response, None, 'empty'
+        if conditional and request.method == 'GET':
+            conditional_response = self.process_conditional_get(
+                request, response)
+            if conditional_response is not response:
+                return conditional_response, None, 'not_modified'
+        padding = self.insert_padding(request, response)
+        if padding is None:
+            padding = self.padding(response)
+            if padding is None:
+                return response, None, 'encoding'
+            # Appending the encoded padding as a new chunk leaves the
+            # existing body bytes untouched; they are only joined once, on
+            # output.
+            _append_padding(response, padding)
+        response._random_comment_applied = APPLIED
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(sum(map(len, response)))
+        _weaken_etag(response)
+        return response, padding, None
+
+    def padding(self, response):
+        """
+        Returns the bytes to append to the response: padding from the
+        strategy for its content type, or padding in the outermost content
+        coding of an encoded body. Returns None if the body's coding can't be
+        padded safely. The length of the padding is drawn from the
+        DEBREACH_PADDING distribution.
+        """
+        if getattr(response, 'streaming', False):
+            size = response.get('Content-Length')
+            size = int(size) if size else None
+        else:
+            size = sum(map(len, response))
+        encoding = response.get('Content-Encoding', '')
+        if encoding:
+            encoding = encoding.rsplit(',', 1)[-1].strip().lower()
+        if not encoding or encoding == 'identity':
+            strategy = get_registry().strategy(
+                response.get('Content-Type', ''))
+            return encode_padding(
+                strategy, self.length(size, strategy), response.charset)
+        if encoding in ENCODED_PADDING:
+            strategy = ENCODED_PADDING[encoding]
+            return strategy(self.length(size, strategy))
+        log.debug(
+            'Not padding response with unsupported Content-Encoding %r',
+            encoding)
+        return None
+
+    def insert_padding(self, request, response):
+        """
+        Inserts padding into an unencoded HTML body, in place of each
+        placeholder output by the ``debreach_pad`` template tag or, if there
+        are none, at the insertion points set by the
+        DEBREACH_INSERTION_POINTS setting. Placeholders are only looked for
+        if the tag was rendered while handling the request, or the
+        DEBREACH_SCAN_PLACEHOLDERS setting is enabled. Returns the padding
+        inserted, or None, leaving the response untouched, if the body is
+        larger than DEBREACH_LARGE_BODY_SIZE or has nowhere to insert
+        padding.
+        """
+        placeholders = self.scan_placeholders \
+            or getattr(request, '_debreach_placeholder', False)
+        if (self.scanner is None and not placeholders) \
+                or response.get('Content-Encoding', 'identity') != 'identity':
+            return None
+        # Inserting padding copies the body, so larger bodies are left to
+        # have a padding chunk appended instead.
+        if sum(map(len, response)) > self.large_body_size:
+            return None
+        strategy = get_registry().strategy(response.get('Content-Type', ''))
+        if strategy is not STRATEGIES['html']:
+            return None
+        body = response.content
+        points, width = self.padding_points(
+            body, strategy, response.charset, placeholders)
+        if not points:
+            return None
+        # Any cap on the padding applies to the body as a whole.
+        size = (len(body) - width * len(points)) // len(points)
+        return _insert_padding(response, body, points, [
+            encode_padding(
+                strategy, self.length(size, strategy), response.charset)
+            for _ in points], width)
+
+    def padding_points(self, body, strategy, charset, placeholders=True):
+        """
+        Returns the offsets in an unencoded body at which padding from
+        ``strategy`` is inserted, and the number of bytes it replaces at
+        each: those of the ``debreach_pad`` placeholders if ``placeholders``
+        is True and there are any, and otherwise none, at the insertion
+        points.
+        """
+        if placeholders and strategy is STRATEGIES['html']:
+            placeholder = PLACEHOLDER.encode(charset)
+            points = _find_all(body, placeholder)
+            if points:
+                return points, len(placeholder)
+        return self.insertion_points(body, strategy), 0
+
+    def length(self, size, strategy):
+        """
+        Returns the length of the random data in padding from ``strategy``
+        for a body of ``size`` bytes.
+        """
+        return self.distribution.length(size, OVERHEAD.get(strategy, 0))
+
+    def insertion_points(self, body, strategy):
+        """
+        Returns the offsets in an unencoded body at which padding from
+        ``strategy`` is inserted, or an empty list if padding is appended
+        instead.
+        """
+        if self.scanner is None or strategy is not STRATEGIES['html'] \
+                or len(body) > self.large_body_size:
+            return []
+        return self.scanner.points(body)
+
+    def process_conditional_get(self, request, response):
+        """
+        Runs the conditional GET check against the unpadded content, adding
+        an ETag first if enabled by the DEBREACH_ETAG setting, so that the
+        ETag is stable and a 304 response can be returned without padding.
+        """
+        if self.etag and not response.has_header('ETag') and all(
+                header.lower() != 'no-store' for header in cc_delim_re.split(
+                    response.get('Cache-Control', ''))):
+            _set_etag(response)
+        etag = response.get('ETag')
+        last_modified = response.get('Last-Modified')
+        last_modified = last_modified and parse_http_date_safe(last_modified)
+        if etag or last_modified:
+            return get_conditional_response(
+                request, etag=etag, last_modified=last_modified,
+                response=response)
         return response
+
+    def pad_streaming_response(self, response):
+        """
+        Wraps the streaming content of the response so that the original
+        chunks are passed through untouched and a random comment follows
+        them. Nothing is buffered, and bodies that turn out to be empty are
+        left unpadded. Returns the same values as ``pad``.
+        """
+        if response.get('Content-Length') == '0':
+            return response, None, 'empty'
+        comment = self.padding(response)
+        if comment is None:
+            return response, None, 'encoding'
+        if response.is_async:
+            response.streaming_content = _pad_async_iterator(
+                response.streaming_content, comment)
+        else:
+            response.streaming_content = _pad_iterator(
+                response.streaming_content, comment)
+        response._random_comment_applied = APPLIED
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(
+                int(response['Content-Length']) + len(comment))
+        _weaken_etag(response)
+        return response, comment, None
+
+    def pad_file_response(self, request, response):
+        """
+        Pads a FileResponse by wrapping its file. Under WSGI the server's
+        ``wsgi.file_wrapper`` still gets the file itself, so it may send it
+        with ``sendfile``, and the padding is sent after it; otherwise the
+        wrapped file is read in blocks. Returns the same values as ``pad``.
+        """
+        if response.get('Content-Length') == '0':
+            return response, None, 'empty'
+        padding = self.padding(response)
+        if padding is None:
+            return response, None, 'encoding'
+        padded = PaddedFile(response.file_to_stream, padding)
+        wrap_file_wrapper(getattr(request, 'environ', {}))
+        # Reassigning the streaming content keeps the wrapper as the file to
+        # stream. It has no tell or seek, so the Content-Length is left as
+        # it was set for the file.
+        response.streaming_content = padded
+        response._random_comment_applied = APPLIED
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(
+                int(response['Content-Length']) + len(padding))
+        _weaken_etag(response)
+        return response, padding, None
+
+
+def _compress_iterator(content, compressor, padding):
+    padded = False
+    for chunk in content:
+        padded = padded or bool(chunk)
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    if padded and padding:
+        yield compressor.compress(padding) + compressor.finish()
+    else:
+        yield compressor.finish()
+
+
+async def _compress_async_iterator(content, compressor, padding):
+    padded = False
+    async for chunk in content:
+        padded = padded or bool(chunk)
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    if padded and padding:
+        yield compressor.compress(padding) + compressor.finish()
+    else:
+        yield compressor.finish()
+
+
+class RandomCommentCompressionMiddleware(RandomCommentMiddleware):
+    """
+    Pads and compresses responses in a single pass, as a replacement for
+    using both GZipMiddleware and RandomCommentMiddleware. The padding is
+    always added before compression. The content coding is negotiated from
+    the DEBREACH_COMPRESSION_CODINGS setting, in order of preference, and
+    compression levels are set by DEBREACH_COMPRESSION_LEVELS.
+    """
+
+    # Like GZipMiddleware, shorter bodies aren't compressed.
+    minimum_length = _GZIP_MINIMUM_LENGTH
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # Responses are compressed here, not by GZipMiddleware.
+        self.native = False
+        self.codings = getattr(
+            settings, 'DEBREACH_COMPRESSION_CODINGS', ('zstd', 'br', 'gzip'))
+        self.levels = dict(
+            DEFAULT_LEVELS,
+            **getattr(settings, 'DEBREACH_COMPRESSION_LEVELS', {}))
+
+    def pad(self, request, response):
+        # The reason is found once, and passed to apply_padding by every
+        # fallback, so that it is never counted twice.
+        reason = self.skip_reason(request, response)
+        if response.has_header('Content-Encoding'):
+            return self.apply_padding(request, response, reason)
+        streaming = getattr(response, 'streaming', False)
+        if not streaming \
+                and sum(map(len, response)) < self.minimum_length:
+            return self.apply_padding(request, response, reason)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = select_coding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''), self.codings)
+        if coding is None:
+            return self.apply_padding(request, response, reason)
+        padding = inserted = None
+        if reason is None:
+            if not streaming and request.method == 'GET':
+                conditional_response = self.process_conditional_get(
+                    request, response)
+                if conditional_response is not response:
+                    return conditional_response, None, 'not_modified'
+            if not streaming:
+                inserted = self.insert_padding(request, response)
+            if inserted is None:
+                padding = self.padding(response)
+                if padding is None:
+                    reason = 'encoding'
+        compressor = COMPRESSORS[coding](self.levels[coding])
+        if streaming:
+            if response.is_async:
+                response.streaming_content = _compress_async_iterator(
+                    response.streaming_content, compressor, padding)
+            else:
+                response.streaming_content = _compress_iterator(
+                    response.streaming_content, compressor, padding)
+            del response['Content-Length']
+        else:
+            length = 0
+            compressed = []
+            for chunk in response:
+                length += len(chunk)
+                compressed.append(compressor.compress(chunk))
+            if padding and length:
+                compressed.append(compressor.compress(padding))
+            elif padding:
+                padding = None
+                reason = 'empty'
+            compressed.append(compressor.finish())
+            content = b''.join(compressed)
+            if len(content) >= length:
+                if inserted is None:
+                    return self.apply_padding(
+                        request, response, reason, conditional=False)
+                # Send the body uncompressed, with the padding that was
+                # inserted into it.
+                response._random_comment_applied = APPLIED
+                if response.has_header('Content-Length'):
+                    response['Content-Length'] = str(length)
+                _weaken_etag(response)
+                return response, inserted, None
+            if inserted is not None:
+                padding = inserted
+            response.content = content
+            response['Content-Length'] = str(len(content))
+        if padding:
+            response._random_comment_applied = APPLIED
+        _weaken_etag(response)
+        response['Content-Encoding'] = coding
+        return response, padding, reason
+
+
+class CSRFCryptMiddleware:
+    """
+    Unmasks the CSRF token submitted with an unsafe request, from the
+    ``csrfmiddlewaretoken`` field or the CSRF header, so that
+    CsrfViewMiddleware compares the secret directly instead of unmasking the
+    token a character at a time. Must be placed before CsrfViewMiddleware.
+    Use it with the ``debreach.context_processors.csrf`` context processor,
+    which masks the token once per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if get_response is None:
+            raise ValueError('get_response must be provided.')
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE') \
+                or getattr(callback, 'csrf_exempt', False):
+            return None
+        header = settings.CSRF_HEADER_NAME
+        secret = unmask_token(request.META.get(header, ''))
+        if secret is not None:
+            request.META[header] = secret
+        if request.method == 'POST':
+            try:
+                post = request.POST
+            except OSError:
+                # CsrfViewMiddleware handles the failed read.
+                return None
+            secret = unmask_token(post.get('csrfmiddlewaretoken', ''))
+            if secret is not None:
+                post._mutable, mutable = True, post._mutable
+                post['csrfmiddlewaretoken'] = secret
+                post._mutable = mutable
+        return None
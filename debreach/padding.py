@@ -0,0 +1,223 @@
+"""
+Padding strategies, and the registry that chooses one by content type.
+
+A strategy is a callable taking the length of the random data to generate,
+as drawn from the DEBREACH_PADDING distribution, and returning the padding, as
+a string, to append to a response body. The DEBREACH_CONTENT_TYPES setting maps
+media types (``type/subtype``, or ``type/*``) to strategies, given either by
+name or as a dotted path to a callable.
+"""
+import functools
+import struct
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from debreach.distributions import get_distribution
+from debreach.entropy import ALPHABET, get_pool
+
+
+_WHITESPACE = bytes(b' \t\n\r'[b & 3] for b in range(256))
+
+
+def random_padding(length=None):
+    """
+    Returns ``length`` random letters and digits, or a number drawn from the
+    configured distribution if no length is given.
+    """
+    if length is None:
+        length = get_distribution().length()
+    return get_pool().random_string(length)
+
+
+def random_comment(length=None):
+    return '<!-- {0} -->'.format(random_padding(length))
+
+
+@functools.lru_cache(maxsize=32)
+def comment_delimiters(charset):
+    """
+    Returns the start and end of a random comment encoded in ``charset``, or
+    None if the charset doesn't encode letters and digits as ASCII.
+    """
+    try:
+        if ALPHABET.decode('ascii').encode(charset) != ALPHABET:
+            return None
+        return '<!-- '.encode(charset), ' -->'.encode(charset)
+    except LookupError:
+        return None
+
+
+def encoded_comment(length, charset):
+    """
+    Returns a random comment encoded in ``charset``. For ASCII-compatible
+    charsets the random data is never decoded and re-encoded.
+    """
+    delimiters = comment_delimiters(charset)
+    if delimiters is None:
+        return random_comment(length).encode(charset)
+    if length is None:
+        length = get_distribution().length()
+    return b''.join((
+        delimiters[0], get_pool().random_bytes(length), delimiters[1]))
+
+
+def encode_padding(strategy, length, charset):
+    """
+    Returns the padding from ``strategy`` encoded in ``charset``.
+    """
+    if strategy is random_comment:
+        return encoded_comment(length, charset)
+    padding = strategy(length)
+    return padding if isinstance(padding, bytes) else padding.encode(charset)
+
+
+def random_whitespace(length=None):
+    """
+    Returns a random run of JSON whitespace, which is valid after any JSON
+    value.
+    """
+    if length is None:
+        length = get_distribution().length()
+    return get_pool().read(length).translate(_WHITESPACE).decode('ascii')
+
+
+def gzip_padding(length=None):
+    """
+    Returns an empty gzip member whose FCOMMENT header field holds the
+    padding. Decoders concatenate members, so appending it to a gzip body
+    randomises its length without touching the compressed data.
+    """
+    return b''.join((
+        b'\x1f\x8b\x08\x10\x00\x00\x00\x00\x00\xff',
+        random_padding(length).encode('ascii'),
+        # Comment terminator, an empty final deflate block, CRC32 and ISIZE.
+        b'\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00',
+    ))
+
+
+def zstd_padding(length=None):
+    """
+    Returns a zstd skippable frame holding the padding, which decoders
+    ignore.
+    """
+    padding = random_padding(length).encode('ascii')
+    return struct.pack('<II', 0x184D2A50, len(padding)) + padding
+
+
+STRATEGIES = {
+    'html': random_comment,
+    'json': random_whitespace,
+}
+
+# Content codings whose bodies can be padded at the container level, without
+# decompressing them. Responses with any other coding are left alone.
+ENCODED_PADDING = {
+    'gzip': gzip_padding,
+    'x-gzip': gzip_padding,
+    'zstd': zstd_padding,
+}
+
+# The bytes each strategy adds around its random data, which count towards
+# any padding budget.
+OVERHEAD = {
+    random_comment: len('<!--  -->'),
+    gzip_padding: 21,
+    zstd_padding: 8,
+}
+
+DEFAULT_CONTENT_TYPES = {
+    'text/html': 'html',
+}
+
+DEFAULT_SCAN_LIMIT = 256 * 1024
+
+# Output by the debreach_pad template tag, and replaced with a random comment
+# by the middleware when it pads the response the template was rendered
+# into. The colon never appears in random data.
+PLACEHOLDER = '<!-- debreach:pad -->'
+
+
+class InsertionScanner:
+    """
+    Finds the points in an encoded HTML body at which padding is inserted:
+    just after the end of each tag containing one of the markers, such as
+    ``</head>`` or ``name="csrfmiddlewaretoken"``. Each marker is located
+    with ``bytes.find``, so the body is never decoded or matched against a
+    regular expression, and only the first ``scan_limit`` bytes are
+    searched.
+    """
+
+    def __init__(self, markers, scan_limit=DEFAULT_SCAN_LIMIT):
+        self.markers = tuple(
+            marker.encode('utf-8') if isinstance(marker, str) else marker
+            for marker in markers)
+        self.scan_limit = scan_limit
+
+    def points(self, body):
+        """
+        Returns the sorted offsets in ``body`` at which to insert padding.
+        """
+        limit = min(len(body), self.scan_limit)
+        points = set()
+        for marker in self.markers:
+            start = body.find(marker, 0, limit)
+            while start != -1:
+                # The marker may itself end the tag, as ``</head>`` does.
+                end = body.find(b'>', start + len(marker) - 1, limit)
+                if end == -1:
+                    break
+                points.add(end + 1)
+                start = body.find(marker, end + 1, limit)
+        return sorted(points)
+
+
+class ContentTypeRegistry:
+    """
+    Maps Content-Type headers to padding strategies. Parsed headers are kept
+    in a bounded LRU cache, so classifying a common value is a dict lookup.
+    """
+
+    def __init__(self, content_types, cache_size=256):
+        self.content_types = {}
+        for media_type, strategy in content_types.items():
+            if isinstance(strategy, str):
+                strategy = STRATEGIES.get(strategy) or import_string(strategy)
+            self.content_types[media_type.lower()] = strategy
+        self.strategy = functools.lru_cache(maxsize=cache_size)(
+            self._strategy)
+
+    def _strategy(self, content_type):
+        media_type = content_type.partition(';')[0].strip().lower()
+        if not media_type:
+            return None
+        strategy = self.content_types.get(media_type)
+        if strategy is None:
+            strategy = self.content_types.get(
+                media_type.partition('/')[0] + '/*')
+        return strategy
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Returns the registry configured by the DEBREACH_CONTENT_TYPES setting.
+    """
+    global _registry
+    registry = _registry
+    if registry is None:
+        registry = _registry = ContentTypeRegistry(getattr(
+            settings, 'DEBREACH_CONTENT_TYPES', DEFAULT_CONTENT_TYPES))
+    return registry
+
+
+def _reset_registry(setting, **kwargs):
+    global _registry
+    if setting == 'DEBREACH_CONTENT_TYPES':
+        _registry = None
+
+
+setting_changed.connect(_reset_registry)
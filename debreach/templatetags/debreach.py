@@ -0,0 +1,48 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from debreach.padding import PLACEHOLDER
+from debreach.utils import mark_placeholder, mark_sensitive
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def debreach_sensitive(context):
+    """
+    Marks the response being rendered as containing a secret. Requires the
+    template to be rendered with a RequestContext.
+    """
+    request = getattr(context, 'request', None)
+    if request is not None:
+        mark_sensitive(request)
+    return ''
+
+
+class PadNode(template.Node):
+
+    def render(self, context):
+        request = getattr(context, 'request', None)
+        if request is not None:
+            mark_placeholder(request)
+        return mark_safe(PLACEHOLDER)
+
+
+@register.tag
+def debreach_pad(parser, token):
+    """
+    Outputs a placeholder that the middleware replaces with a random comment
+    when it pads the response, instead of appending padding to it. Only the
+    response whose body holds the placeholder is affected, so other
+    templates rendered while handling the request don't stop the response
+    being padded. The placeholder is the same every time, so it can be
+    cached in a ``{% cache %}`` block, and is filled in afresh for each
+    response. The middleware only looks for placeholders if the tag was
+    rendered with a RequestContext, unless DEBREACH_SCAN_PLACEHOLDERS is
+    enabled.
+    """
+    if len(token.split_contents()) != 1:
+        raise template.TemplateSyntaxError(
+            "'debreach_pad' takes no arguments.")
+    return PadNode()
@@ -1,14 +1,71 @@
+import asyncio
+import gzip
+import json
 import os
+import pickle
+import re
+import struct
+import tempfile
+import threading
+import tracemalloc
 import unittest
+import zlib
+from io import StringIO
+from wsgiref.util import FileWrapper, setup_testing_defaults
 
-from django.http import HttpResponse
-from django.test import TestCase
+try:
+    import jinja2
+    from jinja2.ext import Extension
+except ImportError:
+    jinja2 = None
+    Extension = object
+
+from asgiref.sync import iscoroutinefunction
+from django.apps import apps
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import CommandError, call_command
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import (
+    _get_new_csrf_string, _mask_cipher_secret, _unmask_cipher_token,
+    get_token, rotate_token)
+from django.template import (
+    Context, Engine, RequestContext, Template, TemplateSyntaxError, engines)
+from django.template.response import TemplateResponse
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.test.client import RequestFactory
-from django.urls import reverse
+from django.urls import path, reverse
+from django.utils.cache import set_response_etag
+from django.utils.decorators import method_decorator
 from django.utils.encoding import force_str
+from django.views import View
+from django.views.decorators.cache import cache_page
 
-from debreach.decorators import append_random_comment, random_comment_exempt
-from debreach.middleware import RandomCommentMiddleware
+from debreach.decorators import (
+    _get_middleware, append_random_comment, random_comment_exempt,
+    random_comment_streaming)
+import debreach
+from debreach.checks import check_middleware, check_settings
+from debreach.compression import COMPRESSORS, select_coding
+from debreach.context_processors import csrf
+from debreach.csrf import get_token as memoised_get_token, unmask_token
+from debreach.distributions import (
+    AdaptiveBudget, AliasTable, GeometricDistribution, ProportionalDistribution,
+    UniformDistribution, get_distribution)
+from debreach.entropy import ALPHABET, EntropyPool, get_pool
+from debreach.exemptions import PrefixTrie, get_index
+from debreach.files import PaddedFile, wrap_file_wrapper
+from debreach.metrics import (
+    Histogram, InProcessCollector, NullCollector, counters, get_collector)
+from debreach.padding import (
+    DEFAULT_CONTENT_TYPES, ContentTypeRegistry, InsertionScanner,
+    PLACEHOLDER, comment_delimiters, encoded_comment, random_comment,
+    random_whitespace)
+from debreach.middleware import (
+    RandomCommentCompressionMiddleware, RandomCommentMiddleware,
+    native_mitigation)
+from debreach.views import metrics
 
 
 def test_view(request):
@@ -85,6 +142,1307 @@ class TestRandomCommentMiddleware(TestCase):
         processed_response = middleware.process_response(request, response)
         self.assertEqual(len(processed_response.content), 0)
 
+    def test_original_body_preserved(self):
+        html = '<html><body><p>Test body.</p></body></html>'
+        response = HttpResponse(html)
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertTrue(response.content.startswith(html.encode('utf-8')))
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_multiple_chunks(self):
+        response = HttpResponse()
+        response.write('<html><body>')
+        response.write(b'<p>Test body.</p>')
+        response.write('</body></html>')
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertTrue(response.content.startswith(
+            b'<html><body><p>Test body.</p></body></html><!-- '))
+
+    def test_content_length_updated(self):
+        html = '<html><body><p>{0}</p></body></html>'.format(
+            ''.join(chr(x) for x in range(0x100, 0x200)))
+        for charset in ('utf-8', 'utf-16-le'):
+            response = HttpResponse(
+                html, content_type='text/html; charset={0}'.format(charset))
+            response['Content-Length'] = str(len(response.content))
+            request = RequestFactory().get('/')
+            middleware = RandomCommentMiddleware(lambda request: response)
+            response = middleware.process_response(request, response)
+            self.assertEqual(
+                int(response['Content-Length']), len(response.content))
+            self.assertTrue(
+                response.content.decode(charset).startswith(html))
+
+    def test_applied_once(self):
+        response = HttpResponse('<html></html>')
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        content = response.content
+        response = middleware.process_response(request, response)
+        self.assertEqual(response.content, content)
+
+
+class TestAsyncMiddleware(TestCase):
+
+    html = '<html><body><p>Test body.</p></body></html>'
+
+    def test_sync_mode(self):
+        middleware = RandomCommentMiddleware(
+            lambda request: HttpResponse(self.html))
+        self.assertFalse(iscoroutinefunction(middleware))
+        response = middleware(RequestFactory().get('/'))
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_async_mode(self):
+        async def get_response(request):
+            return HttpResponse(self.html)
+
+        middleware = RandomCommentMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/')))
+        self.assertTrue(response.content.endswith(b' -->'))
+
+
+class TestConcurrency(TestCase):
+
+    html = b'<html><body><p>Test body.</p></body></html>'
+
+    def view(self, request):
+        response = HttpResponse(self.html)
+        response['Content-Length'] = str(len(self.html))
+        return response
+
+    def assertPaddedOnce(self, responses):
+        paddings = set()
+        for response in responses:
+            content = response.content
+            self.assertEqual(int(response['Content-Length']), len(content))
+            self.assertTrue(content.startswith(self.html))
+            self.assertRegex(
+                content[len(self.html):], rb'^<!-- [A-Za-z0-9]+ -->$')
+            paddings.add(content[len(self.html):])
+        self.assertEqual(len(paddings), len(responses))
+
+    def test_threads(self):
+        handler = RandomCommentMiddleware(append_random_comment(self.view))
+        barrier = threading.Barrier(8)
+        responses = []
+
+        def worker():
+            request = RequestFactory().get('/')
+            barrier.wait()
+            responses.extend(handler(request) for _ in range(100))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(responses), 800)
+        self.assertPaddedOnce(responses)
+
+    def test_tasks(self):
+        async def get_response(request):
+            await asyncio.sleep(0)
+            return self.view(request)
+
+        middleware = RandomCommentMiddleware(get_response)
+
+        async def worker():
+            request = RequestFactory().get('/')
+            return [await middleware(request) for _ in range(100)]
+
+        async def run():
+            return await asyncio.gather(*(worker() for _ in range(8)))
+
+        responses = sum(asyncio.run(run()), [])
+        self.assertEqual(len(responses), 800)
+        self.assertPaddedOnce(responses)
+
+
+class TestStreamingPadding(TestCase):
+
+    chunks = [b'<html><body>', b'<p>Test body.</p>', b'</body></html>']
+
+    def test_streaming_ignored_by_default(self):
+        response = StreamingHttpResponse(iter(self.chunks))
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertEqual(b''.join(response), b''.join(self.chunks))
+
+    @override_settings(DEBREACH_PAD_STREAMING=True)
+    def test_streaming_padded(self):
+        response = StreamingHttpResponse(iter(self.chunks))
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        output = list(response)
+        self.assertEqual(output[:3], self.chunks)
+        self.assertEqual(len(output), 4)
+        self.assertTrue(output[3].startswith(b'<!-- '))
+        self.assertTrue(output[3].endswith(b' -->'))
+
+    @override_settings(DEBREACH_PAD_STREAMING=True)
+    def test_streaming_content_length(self):
+        response = StreamingHttpResponse(iter(self.chunks))
+        response['Content-Length'] = str(len(b''.join(self.chunks)))
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertEqual(
+            int(response['Content-Length']), len(b''.join(response)))
+
+    @override_settings(DEBREACH_PAD_STREAMING=True)
+    def test_streaming_empty_body_ignored(self):
+        response = StreamingHttpResponse(iter([b'']))
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertEqual(b''.join(response), b'')
+
+    @override_settings(DEBREACH_PAD_STREAMING=True)
+    def test_async_streaming_padded(self):
+        async def content():
+            for chunk in self.chunks:
+                yield chunk
+
+        async def consume(response):
+            return [chunk async for chunk in response]
+
+        response = StreamingHttpResponse(content())
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertTrue(response.is_async)
+        output = asyncio.run(consume(response))
+        self.assertEqual(output[:3], self.chunks)
+        self.assertTrue(output[3].startswith(b'<!-- '))
+
+    def test_random_comment_streaming(self):
+        @append_random_comment
+        @random_comment_streaming
+        def test_view(request):
+            return StreamingHttpResponse(iter(self.chunks))
+
+        request = RequestFactory().get('/')
+        response = test_view(request)
+        self.assertTrue(b''.join(response).endswith(b' -->'))
+
+
+class TestEntropyPool(TestCase):
+
+    def test_random_string(self):
+        pool = EntropyPool()
+        for length in range(0, 100):
+            value = pool.random_string(length)
+            self.assertEqual(len(value), length)
+            self.assertTrue(set(value.encode('ascii')) <= set(ALPHABET))
+
+    def test_randbelow(self):
+        pool = EntropyPool()
+        for n in (1, 2, 13, 256, 257, 100000):
+            values = [pool.randbelow(n) for _ in range(200)]
+            self.assertTrue(all(0 <= value < n for value in values))
+        self.assertEqual(
+            {pool.randbelow(13) for _ in range(2000)}, set(range(13)))
+        with self.assertRaises(ValueError):
+            pool.randbelow(0)
+
+    def test_refills_at_low_water(self):
+        pool = EntropyPool(batch_size=32, low_water=8)
+        pool.read(20)
+        buffer = pool.buffer
+        pool.read(5)
+        self.assertIs(pool.buffer, buffer)
+        pool.read(1)
+        self.assertIsNot(pool.buffer, buffer)
+        self.assertEqual(len(pool.buffer) - pool.offset, 7 + 32 - 1)
+
+    def test_per_thread_buffers(self):
+        pool = EntropyPool()
+        pool.read(1)
+        buffers = []
+        thread = threading.Thread(
+            target=lambda: buffers.append((pool.read(1), pool.buffer)))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(buffers[0][1], pool.buffer)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'Requires os.fork')
+    def test_reseeds_after_fork(self):
+        pool = EntropyPool()
+        pool.read(1)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, pool.read(16))
+            os._exit(0)
+        os.close(write_fd)
+        child = os.read(read_fd, 16)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        self.assertEqual(len(child), 16)
+        self.assertNotEqual(child, pool.read(16))
+
+    def test_settings(self):
+        with override_settings(
+                DEBREACH_ENTROPY_BATCH_SIZE=128,
+                DEBREACH_ENTROPY_LOW_WATER=16):
+            self.assertEqual(get_pool().batch_size, 128)
+            self.assertEqual(get_pool().low_water, 16)
+        self.assertEqual(get_pool().batch_size, 4096)
+
+
+class TestDistributions(TestCase):
+
+    def test_alias_table(self):
+        pool = EntropyPool()
+        table = AliasTable([1, 0, 3, 4])
+        samples = [table.sample(pool) for _ in range(8000)]
+        self.assertNotIn(1, samples)
+        self.assertAlmostEqual(samples.count(0) / 8000, 1 / 8, delta=0.03)
+        self.assertAlmostEqual(samples.count(2) / 8000, 3 / 8, delta=0.03)
+        self.assertAlmostEqual(samples.count(3) / 8000, 4 / 8, delta=0.03)
+        self.assertEqual(
+            {AliasTable([1]).sample(pool) for _ in range(10)}, {0})
+        for weights in ([], [0, 0], [1, -1]):
+            with self.assertRaises(ValueError):
+                AliasTable(weights)
+
+    def test_uniform(self):
+        distribution = UniformDistribution(16, 40)
+        lengths = {distribution.length() for _ in range(2000)}
+        self.assertEqual(lengths, set(range(16, 41)))
+
+    def test_geometric(self):
+        distribution = GeometricDistribution(16, 1024, mean=32)
+        lengths = [distribution.length() for _ in range(4000)]
+        self.assertTrue(all(16 <= length <= 1024 for length in lengths))
+        self.assertAlmostEqual(sum(lengths) / 4000 - 16, 32, delta=4)
+        self.assertGreater(lengths.count(16), lengths.count(48))
+
+    def test_proportional(self):
+        distribution = ProportionalDistribution(12, percent=2)
+        self.assertEqual(distribution.length(), 12)
+        self.assertEqual(distribution.length(40), 12)
+        lengths = [distribution.length(100000) for _ in range(1000)]
+        self.assertTrue(all(12 <= length <= 2012 for length in lengths))
+        self.assertGreater(max(lengths), 1500)
+        distribution = ProportionalDistribution(12, maximum=100, percent=2)
+        self.assertLessEqual(
+            max(distribution.length(100000) for _ in range(100)), 100)
+
+    def test_cap(self):
+        distribution = UniformDistribution(16, 1000, cap=10)
+        # Small bodies still get lengths drawn from the floor span.
+        self.assertEqual(
+            {distribution.length(20) for _ in range(1000)},
+            set(range(16, 29)))
+        distribution = UniformDistribution(16, 1000, cap=10, span=4)
+        self.assertEqual(
+            {distribution.length(20) for _ in range(1000)},
+            set(range(16, 21)))
+        self.assertLessEqual(
+            max(distribution.length(2000) for _ in range(100)), 200)
+        self.assertGreater(
+            max(distribution.length(None) for _ in range(100)), 200)
+
+    def test_span(self):
+        with self.assertRaises(ValueError):
+            UniformDistribution(16, 40, span=-1)
+        distribution = UniformDistribution(16, 40, cap=1, span=0)
+        self.assertEqual({distribution.length(20) for _ in range(100)}, {16})
+
+    def test_budget(self):
+        budget = AdaptiveBudget(2, 16, smoothing=0.1)
+        self.assertIsNone(budget.ratio())
+        # A response is narrowed only once the thread is over budget.
+        self.assertEqual(budget.length(500, 10000), 500)
+        lengths = [budget.length(500, 10000) for _ in range(200)]
+        self.assertAlmostEqual(sum(lengths[-100:]) / 100, 200, delta=25)
+        self.assertAlmostEqual(budget.ratio(), 0.02, delta=0.005)
+        # Small bodies exceed the budget, but the floor span still varies.
+        self.assertEqual(
+            {budget.length(length, 100) for length in range(16, 29)},
+            set(range(16, 29)))
+        self.assertGreaterEqual(budget.length(1000, 100), 28)
+
+    def test_budget_overhead(self):
+        budget = AdaptiveBudget(100, 16, smoothing=1)
+        budget.length(10, 1000, overhead=9)
+        self.assertAlmostEqual(budget.ratio(), 0.019)
+
+    def test_budget_per_thread(self):
+        budget = AdaptiveBudget(2, 16, smoothing=0.5)
+        for _ in range(10):
+            budget.length(500, 10000)
+        lengths = []
+        thread = threading.Thread(
+            target=lambda: lengths.append(budget.length(500, 10000)))
+        thread.start()
+        thread.join()
+        self.assertEqual(lengths, [500])
+        self.assertLess(budget.length(500, 10000), 500)
+
+    def test_budget_ratio_weighted(self):
+        budget = AdaptiveBudget(100, 16, smoothing=1)
+        budget.length(10, 10000)
+        padded = threading.Event()
+        done = threading.Event()
+
+        def pad():
+            budget.length(10, 10)
+            padded.set()
+            done.wait()
+
+        # The thread's state is only counted while the thread is alive.
+        thread = threading.Thread(target=pad)
+        thread.start()
+        padded.wait()
+        try:
+            self.assertAlmostEqual(
+                budget.ratio(), (10 + 10) / (10000 + 10))
+        finally:
+            done.set()
+            thread.join()
+
+    @override_settings(
+        DEBREACH_PADDING={
+            'distribution': 'uniform', 'minimum': 16, 'maximum': 1000,
+            'budget': 1, 'smoothing': 0.1},
+        ROOT_URLCONF='debreach.tests')
+    def test_budget_setting(self):
+        distribution = get_distribution()
+        self.assertIsNotNone(distribution.budget)
+        lengths = [distribution.length(20000) for _ in range(500)]
+        self.assertTrue(all(16 <= length <= 1000 for length in lengths))
+        self.assertLess(sum(lengths[-100:]) / 100, 350)
+        self.assertAlmostEqual(
+            self.client.get('/metrics/').json()['padding_ratio'],
+            distribution.budget.ratio())
+
+    def test_settings(self):
+        self.assertIsInstance(get_distribution(), UniformDistribution)
+        self.assertEqual(get_distribution().minimum, 12)
+        self.assertEqual(get_distribution().maximum, 24)
+        with override_settings(DEBREACH_PADDING={
+                'distribution': 'debreach.distributions.GeometricDistribution',
+                'minimum': 20, 'maximum': 200, 'mean': 50}):
+            self.assertIsInstance(get_distribution(), GeometricDistribution)
+            self.assertEqual(get_distribution().minimum, 20)
+
+    @override_settings(DEBREACH_PADDING={
+        'distribution': 'uniform', 'minimum': 40, 'maximum': 40})
+    def test_middleware(self):
+        html = '<html><body><p>Test body.</p></body></html>'
+        response = HttpResponse(html)
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(
+            RequestFactory().get('/'), response)
+        self.assertEqual(
+            len(response.content), len(html) + len('<!--  -->') + 40)
+
+
+def html_view(request):
+    return HttpResponse('<html><body><p>Test body.</p></body></html>')
+
+
+urlpatterns = [
+    path('html/', html_view),
+    path('cached/', cache_page(60)(html_view)),
+]
+
+
+@override_settings(ROOT_URLCONF='debreach.tests')
+class TestConditionalGet(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, **headers):
+        first = self.client.get('/html/', **headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.content.endswith(b' -->'))
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        second = self.client.get(
+            '/html/', HTTP_IF_NONE_MATCH=first['ETag'], **headers)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+        self.assertFalse(getattr(second, '_random_comment_applied', False))
+        third = self.client.get('/html/', **headers)
+        self.assertEqual(first['ETag'], third['ETag'])
+        self.assertNotEqual(first.content, third.content)
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'],
+        DEBREACH_ETAG=True)
+    def test_etag_setting(self):
+        self.assertNotModified()
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'])
+    def test_etag_disabled_by_default(self):
+        response = self.client.get('/html/')
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(MIDDLEWARE=[
+        'django.middleware.http.ConditionalGetMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+    ])
+    def test_conditional_get_middleware_outside(self):
+        self.assertNotModified()
+
+    @override_settings(MIDDLEWARE=[
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.http.ConditionalGetMiddleware',
+    ])
+    def test_conditional_get_middleware_inside(self):
+        self.assertNotModified()
+
+    @override_settings(MIDDLEWARE=[
+        'django.middleware.cache.UpdateCacheMiddleware',
+        'django.middleware.http.ConditionalGetMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.cache.FetchFromCacheMiddleware',
+    ])
+    def test_cache_middleware(self):
+        self.assertNotModified()
+
+    @override_settings(MIDDLEWARE=[
+        'django.middleware.http.ConditionalGetMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+    ])
+    def test_cache_page(self):
+        first = self.client.get('/cached/')
+        second = self.client.get(
+            '/cached/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_last_modified(self):
+        response = HttpResponse('<html></html>')
+        response['Last-Modified'] = 'Sat, 01 Jan 2022 00:00:00 GMT'
+        request = RequestFactory().get(
+            '/', HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2022 00:00:00 GMT')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(DEBREACH_ETAG=True)
+    def test_no_store(self):
+        response = HttpResponse('<html></html>')
+        response['Cache-Control'] = 'no-store'
+        request = RequestFactory().get('/')
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertFalse(response.has_header('ETag'))
+
+
+html_view_calls = []
+
+
+def counted_html_view(request):
+    html_view_calls.append(request)
+    return html_view(request)
+
+
+urlpatterns += [
+    path('counted/', counted_html_view),
+    path('counted-cached/', cache_page(60)(counted_html_view)),
+]
+
+
+class TestLargeBodies(TestCase):
+
+    chunk = b'<p>' + b'x' * (128 * 1024 - 7) + b'</p>'
+
+    def response(self, chunks):
+        response = HttpResponse()
+        for _ in range(chunks):
+            response.write(self.chunk)
+        response['Content-Length'] = str(len(self.chunk) * chunks)
+        return response
+
+    def peak(self, middleware, response):
+        """
+        Returns the peak memory allocated while processing the response.
+        """
+        request = RequestFactory().get('/')
+        # Build the caches used on the hot path first.
+        middleware.process_response(request, HttpResponse('<p></p>'))
+        tracemalloc.start()
+        try:
+            middleware.process_response(request, response)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @override_settings(
+        DEBREACH_ETAG=True,
+        DEBREACH_INSERTION_POINTS=['<p>'],
+        DEBREACH_LARGE_BODY_SIZE=64 * 1024)
+    def test_memory_bounded(self):
+        middleware = RandomCommentMiddleware(lambda request: None)
+        for chunks in (1, 8, 64):
+            response = self.response(chunks)
+            self.assertLess(self.peak(middleware, response), 16 * 1024)
+            self.assertEqual(response.content.count(b'<!-- '), 1)
+            self.assertTrue(response.content.endswith(b' -->'))
+            self.assertEqual(
+                int(response['Content-Length']), len(response.content))
+            self.assertTrue(response['ETag'].startswith('W/"'))
+
+    @override_settings(DEBREACH_INSERTION_POINTS=['<p>'])
+    def test_threshold(self):
+        with override_settings(DEBREACH_LARGE_BODY_SIZE=1024):
+            middleware = RandomCommentMiddleware(lambda request: None)
+        response = middleware.process_response(
+            RequestFactory().get('/'), self.response(2))
+        self.assertEqual(response.content.count(b'<!-- '), 1)
+        self.assertTrue(response.content.endswith(b' -->'))
+        middleware = RandomCommentMiddleware(lambda request: None)
+        response = middleware.process_response(
+            RequestFactory().get('/'), self.response(2))
+        self.assertEqual(response.content.count(b'<!-- '), 2)
+        self.assertTrue(response.content.endswith(b'</p>'))
+
+    @override_settings(DEBREACH_ETAG=True)
+    def test_etag(self):
+        response = self.response(3)
+        etag = set_response_etag(self.response(3))['ETag']
+        middleware = RandomCommentMiddleware(lambda request: None)
+        response = middleware.process_response(
+            RequestFactory().get('/'), response)
+        self.assertEqual(response['ETag'], 'W/' + etag)
+
+
+@override_settings(ROOT_URLCONF='debreach.tests')
+class TestCaching(TestCase):
+
+    html = b'<html><body><p>Test body.</p></body></html>'
+
+    def setUp(self):
+        cache.clear()
+        del html_view_calls[:]
+
+    def test_pickle_drops_padding(self):
+        response = HttpResponse(self.html)
+        response['Content-Length'] = str(len(self.html))
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(
+            RequestFactory().get('/'), response)
+        restored = pickle.loads(pickle.dumps(response))
+        self.assertEqual(restored.content, self.html)
+        self.assertFalse(restored._random_comment_applied)
+        restored = middleware.process_response(
+            RequestFactory().get('/'), restored)
+        self.assertTrue(restored.content.startswith(self.html + b'<!-- '))
+        self.assertEqual(
+            int(restored['Content-Length']), len(restored.content))
+
+    def assertPaddedOnHit(self, url):
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(len(html_view_calls), 1)
+        for response in (first, second):
+            self.assertTrue(response.content.startswith(self.html + b'<!-- '))
+            self.assertEqual(response.content.count(b'<!-- '), 1)
+        self.assertNotEqual(first.content, second.content)
+
+    @override_settings(MIDDLEWARE=[
+        'django.middleware.cache.UpdateCacheMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.cache.FetchFromCacheMiddleware',
+    ])
+    def test_inside_cache_middleware(self):
+        self.assertPaddedOnHit('/counted/')
+
+    @override_settings(MIDDLEWARE=[
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.cache.UpdateCacheMiddleware',
+        'django.middleware.cache.FetchFromCacheMiddleware',
+    ])
+    def test_outside_cache_middleware(self):
+        self.assertPaddedOnHit('/counted/')
+
+    @override_settings(MIDDLEWARE=[
+        'debreach.middleware.RandomCommentMiddleware',
+    ])
+    def test_cache_page(self):
+        self.assertPaddedOnHit('/counted-cached/')
+
+    def test_cache_page_with_decorator(self):
+        view = append_random_comment(cache_page(60)(counted_html_view))
+        first = view(RequestFactory().get('/decorated/'))
+        second = view(RequestFactory().get('/decorated/'))
+        self.assertEqual(len(html_view_calls), 1)
+        for response in (first, second):
+            self.assertEqual(response.content.count(b'<!-- '), 1)
+        self.assertNotEqual(first.content, second.content)
+
+
+class TestEncodedPadding(TestCase):
+
+    html = b'<html><body><p>Test body.</p></body></html>'
+
+    def pad(self, content, encoding, streaming=False):
+        if streaming:
+            response = StreamingHttpResponse(iter([content]))
+        else:
+            response = HttpResponse(content)
+        response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(content))
+        with override_settings(DEBREACH_PAD_STREAMING=True):
+            middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(
+            RequestFactory().get('/'), response)
+        body = b''.join(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        return body
+
+    def test_gzip(self):
+        content = gzip.compress(self.html)
+        for encoding in ('gzip', 'x-gzip', 'identity, gzip'):
+            for streaming in (False, True):
+                body = self.pad(content, encoding, streaming)
+                self.assertTrue(body.startswith(content))
+                self.assertGreater(len(body), len(content) + 12)
+                self.assertEqual(gzip.decompress(body), self.html)
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.assertEqual(decompressor.decompress(body), self.html)
+
+    def test_gzip_padding_length_varies(self):
+        content = gzip.compress(self.html)
+        lengths = {len(self.pad(content, 'gzip')) for _ in range(100)}
+        self.assertGreater(len(lengths), 1)
+
+    def test_zstd(self):
+        content = b'\x28\xb5\x2f\xfd'
+        body = self.pad(content, 'zstd')
+        self.assertTrue(body.startswith(content))
+        magic, size = struct.unpack('<II', body[4:12])
+        self.assertEqual(magic, 0x184D2A50)
+        self.assertEqual(len(body), 12 + size)
+
+    def test_zstd_decodes(self):
+        try:
+            from compression import zstd
+            decompress = zstd.decompress
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:
+                raise unittest.SkipTest('No zstd module available')
+            decompress = zstandard.ZstdDecompressor().decompressobj().decompress
+            content = zstandard.ZstdCompressor().compress(self.html)
+        else:
+            content = zstd.compress(self.html)
+        self.assertEqual(decompress(self.pad(content, 'zstd')), self.html)
+
+    def test_unsupported_encoding_ignored(self):
+        for encoding in ('deflate', 'br', 'gzip, br'):
+            content = b'\x00\x01\x02'
+            self.assertEqual(self.pad(content, encoding), content)
+            self.assertEqual(self.pad(content, encoding, True), content)
+
+
+class TestCompressionMiddleware(TestCase):
+
+    html = '<html><body>{0}</body></html>'.format(
+        '<p>Test body.</p>' * 50).encode('ascii')
+
+    def process(self, response, accept_encoding='gzip', **settings):
+        with override_settings(**settings):
+            middleware = RandomCommentCompressionMiddleware(
+                lambda request: response)
+        request = RequestFactory().get(
+            '/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware.process_response(request, response)
+
+    def assertPaddedThenCompressed(self, content, decompress):
+        content = decompress(content)
+        self.assertTrue(content.startswith(self.html + b'<!-- '))
+        self.assertTrue(content.endswith(b' -->'))
+
+    def test_gzip(self):
+        response = self.process(HttpResponse(self.html))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(
+            int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(self.html))
+        self.assertPaddedThenCompressed(response.content, gzip.decompress)
+        self.assertTrue(response._random_comment_applied)
+
+    def test_level(self):
+        fast = self.process(
+            HttpResponse(self.html),
+            DEBREACH_COMPRESSION_LEVELS={'gzip': 1})
+        self.assertPaddedThenCompressed(fast.content, gzip.decompress)
+
+    @unittest.skipUnless('br' in COMPRESSORS, 'brotli is not installed')
+    def test_brotli(self):
+        import brotli
+        response = self.process(HttpResponse(self.html), 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertPaddedThenCompressed(response.content, brotli.decompress)
+
+    @unittest.skipUnless('zstd' in COMPRESSORS, 'zstd is not installed')
+    def test_zstd(self):
+        response = self.process(HttpResponse(self.html), 'gzip, br, zstd')
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        try:
+            from compression.zstd import decompress
+        except ImportError:
+            import zstandard
+            decompress = zstandard.ZstdDecompressor().decompressobj().decompress
+        self.assertPaddedThenCompressed(response.content, decompress)
+
+    def test_preference(self):
+        response = self.process(
+            HttpResponse(self.html), 'gzip, br, zstd',
+            DEBREACH_COMPRESSION_CODINGS=['gzip'])
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_select_coding(self):
+        self.assertEqual(select_coding('gzip;q=0.5', ['gzip']), 'gzip')
+        self.assertIsNone(select_coding('gzip;q=0', ['gzip']))
+        self.assertIsNone(select_coding('*, gzip;q=0', ['gzip']))
+        self.assertEqual(select_coding('*', ['gzip']), 'gzip')
+        self.assertIsNone(select_coding('', ['gzip']))
+        self.assertIsNone(select_coding('identity', ['gzip']))
+
+    def test_not_accepted(self):
+        response = self.process(HttpResponse(self.html), '')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response.content.startswith(self.html + b'<!-- '))
+
+    def test_short_response_not_compressed(self):
+        response = self.process(HttpResponse('<html></html>'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response.content.startswith(b'<html></html><!-- '))
+
+    def test_non_html_compressed_not_padded(self):
+        response = self.process(
+            HttpResponse(self.html, content_type='text/plain'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.html)
+
+    def test_exempt_compressed_not_padded(self):
+        response = HttpResponse(self.html)
+        response._random_comment_exempt = True
+        response = self.process(response)
+        self.assertEqual(gzip.decompress(response.content), self.html)
+
+    def test_already_encoded(self):
+        content = gzip.compress(self.html)
+        response = HttpResponse(content)
+        response['Content-Encoding'] = 'gzip'
+        response = self.process(response)
+        self.assertEqual(gzip.decompress(response.content), self.html)
+        self.assertGreater(len(response.content), len(content))
+
+    def test_not_modified(self):
+        first = self.process(HttpResponse(self.html), DEBREACH_ETAG=True)
+        with override_settings(DEBREACH_ETAG=True):
+            middleware = RandomCommentCompressionMiddleware(
+                lambda request: None)
+        request = RequestFactory().get(
+            '/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=first['ETag'])
+        response = middleware.process_response(
+            request, HttpResponse(self.html))
+        self.assertEqual(response.status_code, 304)
+
+    def test_streaming(self):
+        chunks = [self.html[:100], self.html[100:]]
+        response = self.process(
+            StreamingHttpResponse(iter(chunks)), DEBREACH_PAD_STREAMING=True)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertPaddedThenCompressed(b''.join(response), gzip.decompress)
+
+    def test_streaming_not_padded_by_default(self):
+        response = self.process(StreamingHttpResponse(iter([self.html])))
+        self.assertEqual(gzip.decompress(b''.join(response)), self.html)
+
+    def test_async_streaming(self):
+        async def content():
+            yield self.html[:100]
+            yield self.html[100:]
+
+        async def consume(response):
+            return b''.join([chunk async for chunk in response])
+
+        response = self.process(
+            StreamingHttpResponse(content()), DEBREACH_PAD_STREAMING=True)
+        self.assertPaddedThenCompressed(
+            asyncio.run(consume(response)), gzip.decompress)
+
+
+class TestSensitiveOnly(TestCase):
+
+    html = '<html><body><p>Test body.</p></body></html>'
+
+    def setUp(self):
+        counters.reset()
+
+    def process(self, request, response=None, **settings):
+        response = response or HttpResponse(self.html)
+        with override_settings(DEBREACH_PAD_SENSITIVE_ONLY=True):
+            middleware = RandomCommentMiddleware(lambda request: response)
+        return middleware.process_response(request, response)
+
+    def test_not_sensitive(self):
+        response = self.process(RequestFactory().get('/'))
+        self.assertEqual(response.content, self.html.encode('ascii'))
+        self.assertEqual(counters.snapshot(), {'skipped_insensitive': 1})
+
+    def test_mark_sensitive(self):
+        request = RequestFactory().get('/')
+        debreach.mark_sensitive(request)
+        response = self.process(request)
+        self.assertTrue(response.content.endswith(b' -->'))
+        self.assertEqual(counters.snapshot(), {'sensitive': 1})
+
+    def test_csrf_token(self):
+        request = RequestFactory().get('/')
+        get_token(request)
+        response = self.process(request)
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_session_accessed(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        self.assertEqual(self.process(request).content.count(b'<!--'), 0)
+        request.session.get('key')
+        self.assertTrue(self.process(request).content.endswith(b' -->'))
+
+    def test_template_tag(self):
+        request = RequestFactory().get('/')
+        template = Template('{% load debreach %}{% debreach_sensitive %}')
+        template.render(RequestContext(request))
+        response = self.process(request)
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_compression_counted_once(self):
+        # Incompressible bodies, and bodies too short to compress, fall back
+        # to being padded uncompressed.
+        for body in (os.urandom(1024), self.html):
+            for sensitive in (False, True):
+                counters.reset()
+                request = RequestFactory().get(
+                    '/', HTTP_ACCEPT_ENCODING='gzip')
+                if sensitive:
+                    debreach.mark_sensitive(request)
+                response = HttpResponse(body)
+                with override_settings(DEBREACH_PAD_SENSITIVE_ONLY=True):
+                    middleware = RandomCommentCompressionMiddleware(
+                        lambda request: response)
+                response = middleware.process_response(request, response)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(
+                    response.content.endswith(b' -->'), sensitive)
+                self.assertEqual(
+                    counters.snapshot(),
+                    {'sensitive': 1} if sensitive
+                    else {'skipped_insensitive': 1})
+
+    @override_settings(
+        DEBREACH_PAD_SENSITIVE_ONLY=True,
+        MIDDLEWARE=[
+            'debreach.middleware.RandomCommentMiddleware',
+            'django.middleware.csrf.CsrfViewMiddleware',
+        ])
+    def test_csrf_token_rendered(self):
+        self.assertFalse(self.client.get(
+            reverse('home')).content.rstrip().endswith(b'-->'))
+        self.assertTrue(self.client.get(
+            reverse('test_form')).content.endswith(b' -->'))
+        self.assertEqual(
+            counters.snapshot(), {'skipped_insensitive': 1, 'sensitive': 1})
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Parses a ``{% cache %}`` block like a fragment cache extension would,
+    without caching.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return [jinja2.nodes.Output(
+            [jinja2.nodes.TemplateData('<cached>')], lineno=lineno)] + body
+
+
+class TestPadTag(TestCase):
+
+    html = '<html><body>{0}<p>Test body.</p></body></html>'
+
+    def render(self, source, request):
+        return Template(
+            '{% load cache debreach %}' + source).render(
+            RequestContext(request))
+
+    def process(self, request, content):
+        response = HttpResponse(content)
+        middleware = RandomCommentMiddleware(lambda request: response)
+        return middleware.process_response(request, response)
+
+    def test_pad(self):
+        request = RequestFactory().get('/')
+        content = self.render(self.html.format('{% debreach_pad %}'), request)
+        self.assertEqual(content, self.html.format(PLACEHOLDER))
+        response = self.process(request, content)
+        self.assertRegex(
+            response.content.decode('ascii'),
+            r'^<html><body><!-- [a-zA-Z0-9]+ --><p>Test body.</p>'
+            r'</body></html>$')
+        self.assertNotEqual(
+            response.content, self.process(request, content).content)
+
+    def test_pad_per_response(self):
+        # A template rendered while handling the request, such as an email,
+        # doesn't stop the response being padded.
+        request = RequestFactory().get('/')
+        self.render('{% debreach_pad %}', request)
+        response = self.process(request, self.html.format(''))
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_pad_template_response(self):
+        request = RequestFactory().get('/')
+        response = TemplateResponse(request, engines['django'].from_string(
+            '{% load debreach %}' + self.html.format('{% debreach_pad %}')))
+        response.render()
+        response = RandomCommentMiddleware(
+            lambda request: response).process_response(request, response)
+        self.assertRegex(
+            response.content.decode('ascii'),
+            r'^<html><body><!-- [a-zA-Z0-9]+ --><p>Test body.</p>'
+            r'</body></html>$')
+
+    @override_settings(DEBREACH_PADDING={
+        'distribution': 'uniform', 'minimum': 40, 'maximum': 40})
+    def test_length_policy(self):
+        request = RequestFactory().get('/')
+        content = self.render('{% debreach_pad %}', request)
+        self.assertEqual(
+            len(self.process(request, content).content),
+            len('<!--  -->') + 40)
+
+    @override_settings(DEBREACH_LARGE_BODY_SIZE=10)
+    def test_large_body(self):
+        request = RequestFactory().get('/')
+        content = self.render(self.html.format('{% debreach_pad %}'), request)
+        response = self.process(request, content)
+        self.assertTrue(response.content.startswith(content.encode('ascii')))
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_cache_fragment(self):
+        engine = Engine(
+            loaders=[('django.template.loaders.locmem.Loader', {
+                'pad.html': '{% load debreach %}{% debreach_pad %}'})],
+            libraries={
+                'cache': 'django.templatetags.cache',
+                'debreach': 'debreach.templatetags.debreach'})
+        for fragment in ('{% debreach_pad %}', '{% include "pad.html" %}'):
+            with self.subTest(fragment=fragment):
+                cache.clear()
+                template = engine.from_string(
+                    '{% load cache debreach %}' + self.html.format(
+                        '{% cache 60 fragment %}' + fragment
+                        + '<p>x</p>{% endcache %}'))
+                request = RequestFactory().get('/')
+                content = template.render(RequestContext(request))
+                self.assertEqual(
+                    content, self.html.format(PLACEHOLDER + '<p>x</p>'))
+                first, second = (
+                    self.process(request, content).content.decode('ascii')
+                    for _ in range(2))
+                self.assertRegex(
+                    first, r'^<html><body><!-- [a-zA-Z0-9]+ --><p>x</p>')
+                self.assertNotEqual(first, second)
+                # The fragment is now cached, placeholder and all, so the
+                # tag isn't rendered and the padding is appended instead.
+                request = RequestFactory().get('/')
+                self.assertEqual(
+                    template.render(RequestContext(request)), content)
+                response = self.process(request, content)
+                self.assertTrue(
+                    response.content.startswith(content.encode('ascii')))
+                self.assertTrue(response.content.endswith(b' -->'))
+                with override_settings(DEBREACH_SCAN_PLACEHOLDERS=True):
+                    response = self.process(request, content)
+                self.assertRegex(
+                    response.content.decode('ascii'),
+                    r'^<html><body><!-- [a-zA-Z0-9]+ --><p>x</p>'
+                    r'<p>Test body.</p></body></html>$')
+
+    def test_arguments(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load debreach %}{% debreach_pad 1 %}')
+
+    @unittest.skipUnless(jinja2 is not None, 'jinja2 is not installed')
+    def test_jinja2(self):
+        environment = jinja2.Environment(autoescape=True, extensions=[
+            'debreach.jinja2ext.DebreachExtension', FragmentCacheExtension])
+        request = RequestFactory().get('/')
+        template = environment.from_string(
+            self.html.format('{% debreach_pad %}'))
+        content = template.render(request=request)
+        self.assertEqual(content, self.html.format(PLACEHOLDER))
+        self.assertRegex(
+            self.process(request, content).content.decode('ascii'),
+            r'^<html><body><!-- [a-zA-Z0-9]+ --><p>')
+        environment.loader = jinja2.DictLoader(
+            {'pad.html': '{% debreach_pad %}'})
+        for fragment in ('{% debreach_pad %}', '{% include "pad.html" %}'):
+            template = environment.from_string(self.html.format(
+                '{% cache %}' + fragment + '<p>x</p>{% endcache %}'))
+            self.assertEqual(
+                template.render(request=request),
+                self.html.format('<cached>' + PLACEHOLDER + '<p>x</p>'))
+
+
+class TestCSRF(TestCase):
+
+    def test_unmask_token(self):
+        for _ in range(200):
+            token = _mask_cipher_secret(_get_new_csrf_string())
+            self.assertEqual(unmask_token(token), _unmask_cipher_token(token))
+        for token in ('', 'a' * 32, 'a' * 63, '-' * 64, '\xe9' * 64):
+            self.assertIsNone(unmask_token(token))
+
+    def test_get_token_memoised(self):
+        request = RequestFactory().get('/')
+        token = memoised_get_token(request)
+        self.assertEqual(unmask_token(token), request.META['CSRF_COOKIE'])
+        del request.META['CSRF_COOKIE_NEEDS_UPDATE']
+        self.assertEqual(memoised_get_token(request), token)
+        self.assertTrue(request.META['CSRF_COOKIE_NEEDS_UPDATE'])
+        rotate_token(request)
+        rotated = memoised_get_token(request)
+        self.assertNotEqual(rotated, token)
+        self.assertEqual(unmask_token(rotated), request.META['CSRF_COOKIE'])
+
+    def test_context_processor(self):
+        request = RequestFactory().get('/')
+        template = Template('{% csrf_token %}')
+        rendered = {
+            template.render(RequestContext(request, processors=[csrf]))
+            for _ in range(3)}
+        self.assertEqual(len(rendered), 1)
+        self.assertIn(request._debreach_csrf_token[1], rendered.pop())
+        self.assertNotEqual(
+            memoised_get_token(request),
+            memoised_get_token(RequestFactory().get('/')))
+
+    @override_settings(MIDDLEWARE=[
+        'debreach.middleware.CSRFCryptMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+    ])
+    def test_middleware(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.get(reverse('test_form'))
+        token = re.search(
+            rb'name="csrfmiddlewaretoken" value="([^"]+)"',
+            response.content).group(1).decode('ascii')
+        self.assertEqual(len(token), 64)
+        self.assertEqual(client.post(
+            reverse('test_form'),
+            {'message': 'x', 'csrfmiddlewaretoken': token}).status_code, 302)
+        self.assertEqual(client.post(
+            reverse('test_form'), {'message': 'x'},
+            HTTP_X_CSRFTOKEN=token).status_code, 302)
+        self.assertEqual(client.post(
+            reverse('test_form'),
+            {'message': 'x', 'csrfmiddlewaretoken': token[::-1]},
+        ).status_code, 403)
+        self.assertEqual(client.post(
+            reverse('test_form'),
+            {'message': 'x', 'csrfmiddlewaretoken': 'x'}).status_code, 403)
+
+
+class TestExemptions(TestCase):
+
+    def test_prefix_trie(self):
+        trie = PrefixTrie(['/health', '/api/', '/api/v1/html/'])
+        self.assertTrue(trie.matches('/health'))
+        self.assertTrue(trie.matches('/healthz'))
+        self.assertTrue(trie.matches('/api/anything'))
+        self.assertFalse(trie.matches('/ap'))
+        self.assertFalse(trie.matches('/'))
+        self.assertFalse(PrefixTrie().matches('/'))
+        self.assertTrue(PrefixTrie(['']).matches('/'))
+
+    def padded(self, url):
+        return self.client.get(url).content.rstrip().endswith(b'-->')
+
+    def test_no_exemptions(self):
+        self.assertIsNone(get_index())
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'],
+        DEBREACH_EXEMPT_PATHS=['/form'])
+    def test_exempt_paths(self):
+        self.assertTrue(self.padded(reverse('home')))
+        self.assertFalse(self.padded(reverse('test_form')))
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'],
+        DEBREACH_EXEMPT_URL_NAMES=['home'])
+    def test_exempt_url_names(self):
+        self.assertFalse(self.padded(reverse('home')))
+        self.assertTrue(self.padded(reverse('test_form')))
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'],
+        DEBREACH_INCLUDE_PATHS=['/form/'])
+    def test_include_paths(self):
+        self.assertFalse(self.padded(reverse('home')))
+        self.assertTrue(self.padded(reverse('test_form')))
+
+    @override_settings(
+        MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'])
+    def test_reloads_on_setting_change(self):
+        self.assertTrue(self.padded(reverse('home')))
+        with self.settings(DEBREACH_EXEMPT_PATHS=['/']):
+            self.assertFalse(self.padded(reverse('home')))
+        self.assertTrue(self.padded(reverse('home')))
+
+
+def fixed_padding(length):
+    return '<!-- fixed -->'
+
+
+class TestContentTypes(TestCase):
+
+    def process(self, content, content_type):
+        response = HttpResponse(content, content_type=content_type)
+        middleware = RandomCommentMiddleware(lambda request: response)
+        return middleware.process_response(RequestFactory().get('/'), response)
+
+    def test_default(self):
+        registry = ContentTypeRegistry(DEFAULT_CONTENT_TYPES)
+        self.assertIs(registry.strategy('text/html'), random_comment)
+        self.assertIs(
+            registry.strategy('Text/HTML; charset=utf-8'), random_comment)
+        self.assertIsNone(registry.strategy('text/plain'))
+        self.assertIsNone(registry.strategy('application/json'))
+        self.assertIsNone(registry.strategy(''))
+
+    def test_cached(self):
+        registry = ContentTypeRegistry(DEFAULT_CONTENT_TYPES)
+        registry.strategy('text/html; charset=utf-8')
+        registry.strategy('text/html; charset=utf-8')
+        self.assertEqual(registry.strategy.cache_info().hits, 1)
+
+    def test_wildcard_and_dotted_path(self):
+        registry = ContentTypeRegistry({
+            'text/*': 'debreach.tests.fixed_padding',
+            'application/json': 'json',
+        })
+        self.assertIs(registry.strategy('text/plain'), fixed_padding)
+        self.assertIs(registry.strategy('application/json'), random_whitespace)
+        self.assertIsNone(registry.strategy('application/xml'))
+
+    @override_settings(DEBREACH_CONTENT_TYPES={
+        'text/html': 'html',
+        'application/xhtml+xml': 'html',
+        'text/vnd.turbo-stream.html': 'html',
+        'application/json': 'json',
+    })
+    def test_settings(self):
+        for content_type in (
+                'application/xhtml+xml', 'text/vnd.turbo-stream.html'):
+            response = self.process('<p></p>', content_type)
+            self.assertTrue(response.content.startswith(b'<p></p><!-- '))
+        response = self.process('{"a": [1, 2]}', 'application/json')
+        self.assertEqual(json.loads(response.content), {'a': [1, 2]})
+        self.assertGreater(len(response.content), len('{"a": [1, 2]}'))
+        self.assertEqual(
+            self.process('abc', 'text/plain').content, b'abc')
+
+
+class TestInsertionPoints(TestCase):
+
+    html = (
+        '<html><head><title>Test</title></head><body><form>'
+        '<input type="hidden" name="csrfmiddlewaretoken" value="token">'
+        '<input type="text" name="q"></form></body></html>')
+    markers = ['</head>', 'name="csrfmiddlewaretoken"']
+
+    def process(self, response, middleware_class=RandomCommentMiddleware,
+                **kwargs):
+        with override_settings(DEBREACH_INSERTION_POINTS=self.markers):
+            middleware = middleware_class(lambda request: response)
+        return middleware.process_response(
+            RequestFactory().get('/', **kwargs), response)
+
+    def unpadded(self, content):
+        return re.sub(rb'<!-- [^ ]* -->', b'', content)
+
+    def test_points(self):
+        scanner = InsertionScanner(self.markers)
+        body = self.html.encode('ascii')
+        head = body.index(b'</head>') + len(b'</head>')
+        token = body.index(b'value="token">') + len(b'value="token">')
+        self.assertEqual(scanner.points(body), [head, token])
+        self.assertEqual(scanner.points(body * 2), [
+            head, token, len(body) + head, len(body) + token])
+        self.assertEqual(scanner.points(b'<p>name="csrfmiddlewaretoken"'), [])
+        self.assertEqual(scanner.points(b'<p></p>'), [])
+
+    def test_scan_limit(self):
+        body = self.html.encode('ascii')
+        scanner = InsertionScanner(self.markers, scan_limit=body.index(b'>'))
+        self.assertEqual(scanner.points(body), [])
+        scanner.scan_limit = body.index(b'</head>') + len(b'</head>')
+        self.assertEqual(len(scanner.points(body)), 1)
+
+    def test_inserted(self):
+        response = HttpResponse(self.html)
+        response['Content-Length'] = len(self.html)
+        response = self.process(response)
+        content = response.content
+        self.assertEqual(self.unpadded(content), self.html.encode('ascii'))
+        self.assertRegex(content, rb'</head><!-- [^ ]* --><body>')
+        self.assertRegex(content, rb'value="token"><!-- [^ ]* --><input')
+        self.assertTrue(content.endswith(b'</html>'))
+        self.assertEqual(int(response['Content-Length']), len(content))
+
+    def test_fallback(self):
+        response = self.process(HttpResponse('<p>Test body.</p>'))
+        self.assertTrue(response.content.startswith(b'<p>Test body.</p>'))
+        self.assertTrue(response.content.endswith(b' -->'))
+        response = self.process(HttpResponse(
+            '{"a": "</head>"}', content_type='application/json'))
+        self.assertEqual(response.content, b'{"a": "</head>"}')
+
+    def test_pickled_unpadded(self):
+        response = pickle.loads(pickle.dumps(
+            self.process(HttpResponse(self.html))))
+        self.assertEqual(response.content, self.html.encode('ascii'))
+        self.assertRegex(
+            self.process(response).content, rb'</head><!-- [^ ]* --><body>')
+
+    def test_compressed(self):
+        response = self.process(
+            HttpResponse(self.html * 4), RandomCommentCompressionMiddleware,
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(response.content)
+        self.assertEqual(content.count(b'<!-- '), 8)
+        self.assertEqual(self.unpadded(content), self.html.encode('ascii') * 4)
+
 
 class TestDecorators(TestCase):
 
@@ -110,13 +1468,671 @@ class TestDecorators(TestCase):
     <body><p>Test body.</p></body>
 </html>'''
 
-        @random_comment_exempt
         def test_view(request):
             return HttpResponse(html)
 
+        exempt_view = random_comment_exempt(test_view)
+        self.assertTrue(exempt_view.random_comment_exempt)
+        # The view itself isn't marked, as it may be routed elsewhere too.
+        self.assertFalse(hasattr(test_view, 'random_comment_exempt'))
         request = RequestFactory().get('/')
-        response = test_view(request)
+        response = exempt_view(request)
         self.assertTrue(response._random_comment_exempt)
+        middleware = RandomCommentMiddleware(lambda request: response)
+        response = middleware.process_response(request, response)
+        self.assertEqual(force_str(response.content), html)
+        response = RandomCommentMiddleware(test_view)(request)
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_append_random_comment_exempt(self):
+        def test_view(request):
+            return HttpResponse('<html></html>')
+
+        async def async_test_view(request):
+            return HttpResponse('<html></html>')
+
+        request = RequestFactory().get('/')
+        exempt_view = random_comment_exempt(test_view)
+        self.assertIs(append_random_comment(exempt_view), exempt_view)
+        view = append_random_comment(random_comment_exempt(test_view))
+        self.assertEqual(view(request).content, b'<html></html>')
+        view = append_random_comment(random_comment_exempt(async_test_view))
+        self.assertEqual(
+            asyncio.run(view(request)).content, b'<html></html>')
+
+    def test_append_random_comment_async(self):
+        @append_random_comment
+        async def test_view(request):
+            return HttpResponse('<html></html>')
+
+        self.assertTrue(iscoroutinefunction(test_view))
+        response = asyncio.run(test_view(RequestFactory().get('/')))
+        self.assertTrue(response.content.startswith(b'<html></html><!-- '))
+
+    def test_append_random_comment_template_response(self):
+        @append_random_comment
+        def test_view(request):
+            return TemplateResponse(request, 'home.html')
+
+        response = test_view(RequestFactory().get('/'))
+        response.render()
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_random_comment_exempt_async(self):
+        @random_comment_exempt
+        async def test_view(request):
+            return HttpResponse('<html></html>')
+
+        self.assertTrue(iscoroutinefunction(test_view))
+        self.assertTrue(test_view.random_comment_exempt)
+        response = asyncio.run(test_view(RequestFactory().get('/')))
+        self.assertTrue(response._random_comment_exempt)
+
+    def test_append_random_comment_class_based(self):
+        html = '<html><body><p>Test body.</p></body></html>'
+
+        class SyncView(View):
+            @method_decorator(append_random_comment)
+            def get(self, request):
+                return HttpResponse(html)
+
+        class AsyncView(View):
+            @method_decorator(append_random_comment)
+            async def get(self, request):
+                return HttpResponse(html)
+
+        @method_decorator(append_random_comment, name='dispatch')
+        class AsyncDispatchView(View):
+            async def get(self, request):
+                return HttpResponse(html)
+
+        request = RequestFactory().get('/')
+        response = SyncView.as_view()(request)
+        self.assertTrue(response.content.endswith(b' -->'))
+        for view_class in (AsyncView, AsyncDispatchView):
+            response = asyncio.run(view_class.as_view()(request))
+            self.assertTrue(response.content.endswith(b' -->'))
+
+    def test_shared_middleware(self):
+        @append_random_comment
+        def first_view(request):
+            return HttpResponse('<html></html>')
+
+        @append_random_comment
+        def second_view(request):
+            return HttpResponse('<html></html>')
+
+        first_view(RequestFactory().get('/'))
+        middleware = _get_middleware(False)
+        second_view(RequestFactory().get('/'))
+        self.assertIs(_get_middleware(False), middleware)
+        with self.settings(DEBREACH_PAD_STREAMING=True):
+            self.assertIsNot(_get_middleware(False), middleware)
+
+
+@random_comment_exempt
+def exempt_view(request):
+    return HttpResponse('<html><body><p>Test body.</p></body></html>')
+
+
+@method_decorator(random_comment_exempt, name='dispatch')
+class ExemptView(View):
+
+    def get(self, request):
+        return HttpResponse('<html><body><p>Test body.</p></body></html>')
+
+
+@method_decorator(random_comment_exempt, name='dispatch')
+class AsyncExemptView(View):
+
+    async def get(self, request):
+        return HttpResponse('<html><body><p>Test body.</p></body></html>')
+
+
+@random_comment_streaming
+def streaming_view(request):
+    return StreamingHttpResponse(iter([b'<html></html>']))
+
+
+urlpatterns += [
+    path('exempt/', exempt_view),
+    path('exempt-class/', ExemptView.as_view()),
+    path('exempt-async-class/', AsyncExemptView.as_view()),
+    path('streaming/', streaming_view),
+]
+
+
+@override_settings(
+    ROOT_URLCONF='debreach.tests',
+    MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'])
+class TestViewMarkers(TestCase):
+
+    def test_exempt_view(self):
+        for url in ('/exempt/', '/exempt-class/'):
+            self.assertFalse(self.client.get(url).content.endswith(b' -->'))
+        self.assertTrue(self.client.get('/html/').content.endswith(b' -->'))
+
+    async def test_exempt_async_view(self):
+        response = await self.async_client.get('/exempt-async-class/')
+        self.assertFalse(response.content.endswith(b' -->'))
+
+    def test_streaming_view(self):
+        response = self.client.get('/streaming/')
+        self.assertTrue(
+            b''.join(response.streaming_content).endswith(b' -->'))
+
+
+HTML_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'test_project', 'templates', 'home.html')
+
+
+def file_view(request):
+    return FileResponse(open(HTML_FILE, 'rb'))
+
+
+def range_view(request):
+    response = FileResponse(open(HTML_FILE, 'rb'), status=206)
+    response['Content-Range'] = 'bytes 0-{0}/{1}'.format(
+        os.path.getsize(HTML_FILE) - 1, os.path.getsize(HTML_FILE))
+    return response
+
+
+urlpatterns += [
+    path('file/', file_view),
+    path('file-range/', range_view),
+]
+
+
+class SendfileWrapper:
+    """
+    Stands in for a server's ``wsgi.file_wrapper`` that sends files by their
+    ``fileno`` when they have one, as with ``sendfile``.
+    """
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+        self.sent_by_fileno = False
+
+    def __iter__(self):
+        if not hasattr(self.filelike, 'fileno'):
+            yield from iter(
+                lambda: self.filelike.read(self.block_size), b'')
+            return
+        self.sent_by_fileno = True
+        fileno = self.filelike.fileno()
+        yield from iter(lambda: os.read(fileno, self.block_size), b'')
+
+    def close(self):
+        self.filelike.close()
+
+
+@override_settings(
+    ROOT_URLCONF='debreach.tests',
+    ALLOWED_HOSTS=['testserver'],
+    DEBREACH_PAD_FILES=True,
+    MIDDLEWARE=['debreach.middleware.RandomCommentMiddleware'])
+class TestFileResponses(SimpleTestCase):
+
+    def setUp(self):
+        with open(HTML_FILE, 'rb') as f:
+            self.html = f.read()
+
+    def serve(self, path, file_wrapper, **environ):
+        """
+        Runs a request through the WSGI handler as a server would, returning
+        the status, headers, body and the file wrapper used.
+        """
+        wrappers = []
+
+        def wrap(filelike, block_size):
+            wrappers.append(file_wrapper(filelike, block_size))
+            return wrappers[-1]
+
+        environ.update(PATH_INFO=path, HTTP_HOST='testserver')
+        if file_wrapper is not None:
+            environ['wsgi.file_wrapper'] = wrap
+        setup_testing_defaults(environ)
+        started = []
+        result = WSGIHandler()(
+            environ, lambda status, headers: started.extend(
+                (status, dict(headers))))
+        try:
+            body = b''.join(result)
+        finally:
+            result.close()
+        return started[0], started[1], body, \
+            wrappers[0] if wrappers else None
+
+    def assertPadded(self, headers, body):
+        self.assertTrue(body.startswith(self.html))
+        self.assertTrue(body[len(self.html):].startswith(b'<!-- '))
+        self.assertTrue(body.endswith(b' -->'))
+        self.assertEqual(int(headers['Content-Length']), len(body))
+
+    def test_file_wrapper(self):
+        status, headers, body, wrapper = self.serve('/file/', FileWrapper)
+        self.assertEqual(status, '200 OK')
+        self.assertIsInstance(wrapper, FileWrapper)
+        # The server's wrapper gets the file itself, which is closed with
+        # the response.
+        self.assertNotIsInstance(wrapper.filelike, PaddedFile)
+        self.assertTrue(wrapper.filelike.closed)
+        self.assertPadded(headers, body)
+
+    def test_sendfile(self):
+        # A server that sends the file by its fileno still does so, and the
+        # padding is sent after it.
+        status, headers, body, wrapper = self.serve(
+            '/file/', SendfileWrapper)
+        self.assertTrue(wrapper.sent_by_fileno)
+        self.assertPadded(headers, body)
+
+    def test_without_file_wrapper(self):
+        # Without a wsgi.file_wrapper the padded file is read in blocks.
+        status, headers, body, wrapper = self.serve('/file/', None)
+        self.assertEqual(status, '200 OK')
+        self.assertPadded(headers, body)
+
+    def test_range_not_padded(self):
+        status, headers, body, wrapper = self.serve(
+            '/file-range/', FileWrapper)
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(body, self.html)
+        self.assertEqual(int(headers['Content-Length']), len(self.html))
+
+    @override_settings(DEBREACH_PAD_FILES=False)
+    def test_files_ignored_by_default(self):
+        status, headers, body, wrapper = self.serve('/file/', FileWrapper)
+        self.assertNotIsInstance(wrapper.filelike, PaddedFile)
+        self.assertEqual(body, self.html)
+
+    def test_wrap_file_wrapper(self):
+        environ = {'wsgi.file_wrapper': FileWrapper}
+        wrap_file_wrapper(environ)
+        wrap_file_wrapper(environ)
+        self.assertEqual(environ['wsgi.file_wrapper'].args, (FileWrapper,))
+        with open(HTML_FILE, 'rb') as f:
+            self.assertIsInstance(
+                environ['wsgi.file_wrapper'](f), FileWrapper)
+        environ = {}
+        wrap_file_wrapper(environ)
+        self.assertEqual(environ, {})
+
+    def test_padded_file_reads(self):
+        with open(HTML_FILE, 'rb') as f:
+            padded = PaddedFile(f, b'<!-- padding -->')
+            chunks = list(iter(lambda: padded.read(64), b''))
+        self.assertEqual(chunks[-1], b'<!-- padding -->')
+        self.assertEqual(b''.join(chunks), self.html + b'<!-- padding -->')
+        with open(HTML_FILE, 'rb') as f:
+            self.assertEqual(
+                PaddedFile(f, b'!').read(), self.html + b'!')
+
+
+urlpatterns += [
+    path('metrics/', metrics),
+]
+
+
+@override_settings(
+    DEBREACH_COLLECTOR='debreach.metrics.InProcessCollector',
+    ROOT_URLCONF='debreach.tests')
+class TestMetrics(TestCase):
+
+    html = '<html><body><p>Test body.</p></body></html>'
+
+    def setUp(self):
+        get_collector().reset()
+
+    def process(self, response, middleware_class=RandomCommentMiddleware,
+                **kwargs):
+        middleware = middleware_class(lambda request: response)
+        return middleware.process_response(
+            RequestFactory().get('/', **kwargs), response)
+
+    def test_null_collector_by_default(self):
+        with override_settings(DEBREACH_COLLECTOR=None):
+            self.assertIsInstance(get_collector(), NullCollector)
+            self.assertFalse(get_collector().enabled)
+            self.assertEqual(get_collector().snapshot(), {})
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0, 1, 2, 3, 4, 1000):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), {
+            'count': 6,
+            'sum': 1010,
+            'buckets': {0: 1, 1: 1, 3: 2, 7: 1, 1023: 1},
+        })
+        histogram.reset()
+        self.assertEqual(histogram.snapshot()['count'], 0)
+
+    def test_padded(self):
+        response = self.process(HttpResponse(self.html))
+        snapshot = get_collector().snapshot()
+        self.assertEqual(snapshot['counters'], {
+            'padded': 1,
+            'padding_bytes': len(response.content) - len(self.html),
+        })
+        self.assertEqual(snapshot['duration_ns']['count'], 1)
+
+    def test_skip_reasons(self):
+        exempt = HttpResponse(self.html)
+        exempt._random_comment_exempt = True
+        applied = self.process(HttpResponse(self.html))
+        get_collector().reset()
+        self.process(applied)
+        self.process(exempt)
+        self.process(HttpResponse(self.html, content_type='text/plain'))
+        self.process(StreamingHttpResponse([self.html]))
+        self.process(HttpResponse(''))
+        encoded = HttpResponse(self.html)
+        encoded['Content-Encoding'] = 'br'
+        self.process(encoded)
+        self.process(
+            HttpResponse(self.html, headers={'ETag': '"etag"'}),
+            HTTP_IF_NONE_MATCH='"etag"')
+        self.assertEqual(get_collector().snapshot()['counters'], {
+            'skipped_exempt': 1,
+            'skipped_applied': 1,
+            'skipped_content_type': 1,
+            'skipped_streaming': 1,
+            'skipped_empty': 1,
+            'skipped_encoding': 1,
+            'skipped_not_modified': 1,
+        })
+        self.assertEqual(get_collector().snapshot()['duration_ns']['count'], 7)
+
+    def test_compression_middleware(self):
+        self.process(
+            HttpResponse(self.html * 10), RandomCommentCompressionMiddleware,
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.process(
+            HttpResponse(self.html * 10, content_type='text/plain'),
+            RandomCommentCompressionMiddleware, HTTP_ACCEPT_ENCODING='gzip')
+        counts = get_collector().snapshot()['counters']
+        self.assertEqual(counts['padded'], 1)
+        self.assertEqual(counts['skipped_content_type'], 1)
+
+    def test_threads(self):
+        collector = InProcessCollector()
+
+        def record():
+            for _ in range(1000):
+                collector.padded(10, 100)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = collector.snapshot()
+        self.assertEqual(
+            snapshot['counters'], {'padded': 8000, 'padding_bytes': 80000})
+        self.assertEqual(snapshot['duration_ns']['count'], 8000)
+
+    def test_view(self):
+        self.process(HttpResponse(self.html))
+        response = self.client.get('/metrics/')
+        data = json.loads(response.content)
+        self.assertEqual(data['collector']['counters']['padded'], 1)
+        self.assertIn('counters', data)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+class TestProfileCommand(TestCase):
+
+    def test_profile(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as profile_dir:
+            call_command(
+                'debreach_profile', 'home', '/form/', '--requests', '5',
+                '--warmup', '1', '--profile-dir', profile_dir, stdout=out)
+            self.assertEqual(
+                sorted(os.listdir(profile_dir)), ['form.prof', 'home.prof'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[1].split()[:2], ['home', 'without'])
+        self.assertEqual(lines[2].split()[:2], ['home', 'with'])
+        self.assertEqual(lines[3].split()[:2], ['home', 'added'])
+        self.assertGreater(float(lines[3].split()[2]), 0)
+
+    def test_invalid(self):
+        with self.assertRaises(CommandError):
+            call_command('debreach_profile', 'no-such-url', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command(
+                'debreach_profile', 'home', '--requests', '1',
+                stdout=StringIO())
+
+
+class TestPrepadCommand(TestCase):
+
+    html = b'<html><head><title>Test</title></head><body></body></html>'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.source = os.path.join(directory.name, 'source')
+        self.output = os.path.join(directory.name, 'output')
+        os.makedirs(os.path.join(self.source, 'sub'))
+        for name in ('index.html', 'sub/page.html'):
+            self.write(name, self.html)
+        self.write('style.css', b'body {}')
+
+    def write(self, name, content):
+        with open(os.path.join(self.source, name), 'wb') as f:
+            f.write(content)
+
+    def prepad(self, *args):
+        out = StringIO()
+        call_command(
+            'debreach_prepad', self.source, self.output, '--variants', '3',
+            '--workers', '1', *args, stdout=out)
+        with open(os.path.join(self.output, 'manifest.json')) as f:
+            return out.getvalue().strip(), json.load(f)
+
+    def read(self, name):
+        with open(os.path.join(self.output, name), 'rb') as f:
+            return f.read()
+
+    def test_variants(self):
+        output, manifest = self.prepad()
+        self.assertEqual(output, '2 padded, 0 unchanged, 0 removed.')
+        self.assertEqual(sorted(manifest['files']), [
+            'index.html', 'sub/page.html'])
+        entry = manifest['files']['sub/page.html']
+        self.assertEqual(entry['size'], len(self.html))
+        self.assertEqual(entry['variants'], [
+            'sub/page.0.html', 'sub/page.1.html', 'sub/page.2.html'])
+        paddings = set()
+        for variant in entry['variants']:
+            content = self.read(variant)
+            self.assertTrue(content.startswith(self.html))
+            self.assertRegex(
+                content[len(self.html):], rb'^<!-- [A-Za-z0-9]+ -->$')
+            paddings.add(content)
+        self.assertEqual(len(paddings), 3)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output, 'style.0.css')))
+
+    @override_settings(DEBREACH_INSERTION_POINTS=['</title>'])
+    def test_insertion_points(self):
+        self.prepad()
+        content = self.read('index.0.html')
+        self.assertRegex(
+            content, rb'^<html><head><title>Test</title><!-- [A-Za-z0-9]+ '
+                     rb'--></head><body></body></html>$')
+
+    @override_settings(DEBREACH_INSERTION_POINTS=['</title>'])
+    def test_placeholders(self):
+        self.write('index.html', self.html.replace(
+            b'<body>', b'<body>' + PLACEHOLDER.encode('ascii') * 2))
+        self.prepad()
+        content = self.read('index.0.html')
+        self.assertRegex(
+            content, rb'^<html><head><title>Test</title></head><body>'
+                     rb'<!-- [A-Za-z0-9]+ --><!-- [A-Za-z0-9]+ -->'
+                     rb'</body></html>$')
+
+    def test_incremental(self):
+        self.prepad()
+        self.write('index.html', self.html + b'\n')
+        os.unlink(os.path.join(self.source, 'sub', 'page.html'))
+        output, manifest = self.prepad()
+        self.assertEqual(output, '1 padded, 0 unchanged, 1 removed.')
+        self.assertTrue(self.read('index.0.html').startswith(
+            self.html + b'\n'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output, 'sub', 'page.0.html')))
+        output, manifest = self.prepad()
+        self.assertEqual(output, '0 padded, 1 unchanged, 0 removed.')
+        output, manifest = self.prepad('--variants', '2')
+        self.assertEqual(output, '1 padded, 0 unchanged, 0 removed.')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output, 'index.2.html')))
+        with override_settings(DEBREACH_PADDING={
+                'distribution': 'uniform', 'minimum': 30, 'maximum': 40}):
+            output, manifest = self.prepad('--variants', '2')
+        self.assertEqual(output, '1 padded, 0 unchanged, 0 removed.')
+
+    def test_process_pool(self):
+        out = StringIO()
+        call_command(
+            'debreach_prepad', self.source, self.output, '--workers', '2',
+            stdout=out)
+        self.assertEqual(
+            out.getvalue().strip(), '2 padded, 0 unchanged, 0 removed.')
+        contents = {self.read('index.{0}.html'.format(i)) for i in range(8)}
+        self.assertEqual(len(contents), 8)
+
+    def test_invalid(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                'debreach_prepad', self.source, self.source, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command(
+                'debreach_prepad', os.path.join(self.source, 'missing'),
+                self.output, stdout=StringIO())
+
+
+def long_html_view(request):
+    return HttpResponse(
+        '<html><body>{0}</body></html>'.format('<p>Test body.</p>' * 20))
+
+
+urlpatterns += [
+    path('long/', long_html_view),
+]
+
+
+class TestChecks(TestCase):
+
+    def check_ids(self, check):
+        return [message.id for message in check(None)]
+
+    @override_settings(MIDDLEWARE=[
+        'django.middleware.gzip.GZipMiddleware',
+        'debreach.middleware.RandomCommentMiddleware',
+        'debreach.middleware.CSRFCryptMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+    ])
+    def test_valid_middleware(self):
+        self.assertEqual(self.check_ids(check_middleware), [])
+
+    @override_settings(
+        MIDDLEWARE=[],
+        MIDDLEWARE_CLASSES=['debreach.middleware.RandomCommentMiddleware'])
+    def test_stale_middleware_classes(self):
+        self.assertEqual(self.check_ids(check_middleware), ['debreach.W001'])
+
+    @override_settings(MIDDLEWARE=['debreach.middleware.NoSuchMiddleware'])
+    def test_missing_middleware(self):
+        self.assertEqual(self.check_ids(check_middleware), ['debreach.E001'])
+
+    @override_settings(MIDDLEWARE=[
+        'debreach.middleware.RandomCommentMiddleware',
+        'django.middleware.gzip.GZipMiddleware',
+        'debreach.middleware.RandomCommentCompressionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'debreach.middleware.CSRFCryptMiddleware',
+    ])
+    def test_middleware_order(self):
+        self.assertEqual(self.check_ids(check_middleware), [
+            'debreach.W002', 'debreach.W003', 'debreach.W004',
+            'debreach.W005'])
+
+    def test_valid_settings(self):
+        self.assertEqual(self.check_ids(check_settings), [])
+
+    @override_settings(
+        DEBREACH_PADDING={'distribution': 'uniform', 'minimum': -1},
+        DEBREACH_COLLECTOR='debreach.metrics.NoSuchCollector')
+    def test_invalid_settings(self):
+        self.assertEqual(
+            self.check_ids(check_settings),
+            ['debreach.E002', 'debreach.E002'])
+
+    @override_settings(
+        DEBREACH_PADDING={'distribution': 'uniform', 'minimum': -1})
+    def test_warm_up_ignores_invalid_settings(self):
+        apps.get_app_config('debreach').warm_up()
+        with self.assertRaises(ValueError):
+            get_distribution()
+
+    @override_settings(DEBREACH_PADDING={'distribution': 'geometric'})
+    def test_warm_up(self):
+        self.assertIsNone(debreach.distributions._distribution)
+        apps.get_app_config('debreach').warm_up()
+        self.assertIsInstance(
+            debreach.distributions._distribution, GeometricDistribution)
+
+
+@override_settings(ROOT_URLCONF='debreach.tests', MIDDLEWARE=[
+    'django.middleware.gzip.GZipMiddleware',
+    'debreach.middleware.RandomCommentMiddleware',
+])
+class TestNativeMitigation(TestCase):
+
+    def test_detected(self):
+        self.assertTrue(native_mitigation())
+        with override_settings(MIDDLEWARE=[
+                'debreach.middleware.RandomCommentMiddleware',
+                'django.middleware.gzip.GZipMiddleware']):
+            self.assertFalse(native_mitigation())
+        with override_settings(MIDDLEWARE=[
+                'debreach.middleware.RandomCommentMiddleware']):
+            self.assertFalse(native_mitigation())
+
+    def test_compressed_not_padded(self):
+        response = self.client.get('/long/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(
+            gzip.decompress(response.content).endswith(b'</html>'))
+
+    def test_uncompressed_padded(self):
+        response = self.client.get('/long/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response.content.endswith(b' -->'))
+        response = self.client.get('/html/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.content.endswith(b' -->'))
+
+    @override_settings(DEBREACH_NATIVE_MITIGATION=False)
+    def test_disabled(self):
+        response = self.client.get('/long/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(
+            gzip.decompress(response.content).endswith(b' -->'))
+
+    def test_encoded_comment(self):
+        comment = encoded_comment(16, 'utf-8')
+        self.assertRegex(comment, rb'^<!-- [A-Za-z0-9]{16} -->$')
+        self.assertIsNone(comment_delimiters('utf-16'))
+        self.assertRegex(
+            encoded_comment(16, 'utf-16').decode('utf-16'),
+            r'^<!-- [A-Za-z0-9]{16} -->$')
 
 
 @unittest.skipUnless(
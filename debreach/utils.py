@@ -0,0 +1,34 @@
+from django.conf import settings
+
+
+def mark_sensitive(request):
+    """
+    Marks the response to the request as containing a secret, so that it is
+    padded when DEBREACH_PAD_SENSITIVE_ONLY is enabled.
+    """
+    request._debreach_sensitive = True
+
+
+def mark_placeholder(request):
+    """
+    Notes that a ``debreach_pad`` placeholder was rendered while handling
+    the request, so that the middleware looks for placeholders in the
+    response.
+    """
+    request._debreach_placeholder = True
+
+
+def is_sensitive(request, response):
+    """
+    Returns True if a secret may have been emitted while handling the
+    request: it has been marked with ``mark_sensitive``, a CSRF token was
+    requested, or the session was accessed.
+    """
+    if getattr(request, '_debreach_sensitive', False):
+        return True
+    # CsrfViewMiddleware clears CSRF_COOKIE_NEEDS_UPDATE once it has set the
+    # cookie, so when it runs first the cookie on the response is the signal.
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE') \
+            or settings.CSRF_COOKIE_NAME in response.cookies:
+        return True
+    return getattr(getattr(request, 'session', None), 'accessed', False)
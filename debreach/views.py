@@ -0,0 +1,21 @@
+from django.http import JsonResponse
+from django.views.decorators.cache import never_cache
+
+from debreach.distributions import get_distribution
+from debreach.metrics import counters, get_collector
+
+
+@never_cache
+def metrics(request):
+    """
+    Returns a JSON snapshot of the metrics recorded by the configured
+    collector, of the DEBREACH_PAD_SENSITIVE_ONLY counters, and the ratio of
+    padding to body bytes if a padding budget is set, in the current process.
+    The view has no access control of its own.
+    """
+    budget = get_distribution().budget
+    return JsonResponse({
+        'collector': get_collector().snapshot(),
+        'counters': counters.snapshot(),
+        'padding_ratio': budget.ratio() if budget is not None else None,
+    })
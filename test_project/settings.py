@@ -107,7 +107,7 @@ if django.VERSION < (1, 10):
         'debreach.context_processors.csrf',
     )
 else:
-    MIDDLEWARE_CLASSES = (
+    MIDDLEWARE = (
         'debreach.middleware.RandomCommentMiddleware',
         'django.middleware.common.CommonMiddleware',
         'django.contrib.sessions.middleware.SessionMiddleware',
@@ -123,6 +123,7 @@ else:
         'django.template.context_processors.media',
         'django.template.context_processors.static',
         'django.contrib.messages.context_processors.messages',
+        'debreach.context_processors.csrf',
     )
 
 ROOT_URLCONF = 'test_project.urls'